@@ -4,17 +4,31 @@ from django.http import JsonResponse
 from dotenv import load_dotenv
 from django.urls import resolve
 
+from .rate_limit import load_api_keys, rate_limiter
+
 # Load environment variables
 load_dotenv()
 
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY')
+# Routes whose POSTs start comparisons; only these count against a key's rate and concurrency limits
+RATE_LIMITED_URL_NAMES = {'compare', 'jobs'}
+
+
+def is_admin_request(request):
+    """Check if the request carries the admin API key (admin features are off when ADMIN_API_KEY is unset)."""
+    return bool(ADMIN_API_KEY) and request.headers.get('X-API-Key') == ADMIN_API_KEY
+
+
 class APIKeyValidationMiddleware:
     """
-    Middleware to check if the request contains a valid API key in the headers.
+    Middleware to check if the request contains a valid API key in the headers,
+    and to enforce that key's rate and concurrency limits (see core/rate_limit.py)
+    on the requests that start comparisons. The admin key is not limited.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
-        self.valid_api_key = os.getenv('API_KEY', "ddfdddd")
+        self.api_keys = load_api_keys()
 
     def __call__(self, request):
         url_name = resolve(request.path_info).url_name
@@ -23,13 +37,46 @@ class APIKeyValidationMiddleware:
             # For debugging purposes
             return self.get_response(request)
 
+        if url_name == 'health':
+            # Load balancer and orchestrator probes carry no API key
+            return self.get_response(request)
+
         # Get the API key from the request header
         api_key = request.headers.get('X-API-Key')
 
+        if is_admin_request(request):
+            return self.get_response(request)
+
         # Check if the API key is present and valid
-        if not api_key or api_key != self.valid_api_key:
+        limits = self.api_keys.get(api_key) if api_key else None
+        if limits is None:
             return JsonResponse({'error': 'Invalid or missing API key'}, status=403)
 
+        if url_name not in RATE_LIMITED_URL_NAMES or request.method != 'POST':
+            # Polling a job or reading metrics must not use up the comparison budget
+            return self.get_response(request)
+
+        try:
+            decision = rate_limiter.acquire(limits)
+        except Exception as e:
+            # An unavailable limiter store must not take the API down with it
+            print(f"Rate limiter unavailable, admitting request: {e}")
+            return self.get_response(request)
+
+        if not decision.admitted:
+            message = (
+                'Too many concurrent requests for this API key' if decision.reason == 'concurrency'
+                else 'Rate limit exceeded for this API key'
+            )
+            response = JsonResponse({'error': f'{message}, please retry later.'}, status=429)
+            response['Retry-After'] = str(decision.retry_after)
+            return response
+
         # Proceed to the next middleware or view
-        response = self.get_response(request)
-        return response
+        try:
+            return self.get_response(request)
+        finally:
+            try:
+                rate_limiter.release(decision.lease_id)
+            except Exception as e:
+                print(f"Failed to release rate limiter lease {decision.lease_id}: {e}")
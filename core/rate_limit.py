@@ -0,0 +1,200 @@
+import os
+import json
+import math
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+# SQLite file shared by every worker on the host; holds the token buckets, leases and usage counters
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", str(BASE_DIR / "rate_limit.sqlite3"))
+# Limits of keys that do not set their own; 0 disables the limit
+RATE_LIMIT_DEFAULT_RATE = float(os.getenv("RATE_LIMIT_DEFAULT_RATE", 5))
+RATE_LIMIT_DEFAULT_BURST = float(os.getenv("RATE_LIMIT_DEFAULT_BURST", 10))
+RATE_LIMIT_DEFAULT_MAX_CONCURRENT = int(os.getenv("RATE_LIMIT_DEFAULT_MAX_CONCURRENT", 4))
+# Retry-After sent when a key is at its concurrency limit
+RATE_LIMIT_CONCURRENCY_RETRY_AFTER = int(os.getenv("RATE_LIMIT_CONCURRENCY_RETRY_AFTER", 1))
+# A request slot is reclaimed after this many seconds even if its worker never released it
+RATE_LIMIT_LEASE_SECONDS = float(os.getenv("RATE_LIMIT_LEASE_SECONDS", 600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS leases (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, pid INTEGER NOT NULL, expires REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS leases_key ON leases (key);
+CREATE TABLE IF NOT EXISTS usage (key TEXT NOT NULL, counter TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (key, counter));
+"""
+
+
+class KeyLimits:
+    """Name and limits of one API key; the name is what gets stored and reported, never the key."""
+
+    def __init__(self, name, rate=None, burst=None, max_concurrent=None):
+        self.name = name
+        self.rate = float(RATE_LIMIT_DEFAULT_RATE if rate is None else rate)
+        self.burst = float(max(RATE_LIMIT_DEFAULT_BURST if burst is None else burst, 1))
+        self.max_concurrent = int(RATE_LIMIT_DEFAULT_MAX_CONCURRENT if max_concurrent is None else max_concurrent)
+
+
+class Decision:
+    """Outcome of ``RateLimiter.acquire``; ``lease_id`` must be passed to ``release`` once the request is done."""
+
+    def __init__(self, admitted, reason=None, retry_after=None, lease_id=None):
+        self.admitted = admitted
+        self.reason = reason
+        self.retry_after = retry_after
+        self.lease_id = lease_id
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class RateLimiter:
+    """
+    Token-bucket and concurrency limits per API key, shared by the workers of a host.
+
+    State lives in a SQLite file and every decision runs in one ``BEGIN
+    IMMEDIATE`` transaction, so concurrent workers see each other's requests.
+    A request holds a lease while it runs; leases of crashed workers expire
+    after RATE_LIMIT_LEASE_SECONDS, or earlier once their process is gone.
+    """
+
+    def __init__(self, path=RATE_LIMIT_DB):
+        self.path = path
+        self._local = threading.local()
+
+    def acquire(self, limits):
+        """Admit a request of the key described by ``limits``, or say why not and when to retry."""
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            decision = self._decide(connection, limits, now)
+            self._count(connection, limits.name, "admitted" if decision.admitted else f"rejected_{decision.reason}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return decision
+
+    def release(self, lease_id):
+        if lease_id is not None:
+            self._connection().execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+    def usage(self):
+        """Usage counters of every key, e.g. ``{"acme": {"admitted": 10, "rejected_rate": 2}}``."""
+        usage = {}
+        for key, counter, count in self._connection().execute("SELECT key, counter, count FROM usage"):
+            usage.setdefault(key, {})[counter] = count
+        return usage
+
+    def collect_metrics(self):
+        """Per-key usage totals of all workers, as gauges for /api/metrics."""
+        return {
+            f"ratelimit.{key}.{counter}": count
+            for key, counters in self.usage().items()
+            for counter, count in counters.items()
+        }
+
+    def _decide(self, connection, limits, now):
+        if limits.max_concurrent:
+            connection.execute("DELETE FROM leases WHERE expires < ?", (now,))
+            in_flight = self._in_flight(connection, limits.name)
+            if in_flight >= limits.max_concurrent:
+                # Only look for leases of dead workers when they would make a difference
+                dead = [
+                    lease_id for lease_id, pid in connection.execute(
+                        "SELECT id, pid FROM leases WHERE key = ?", (limits.name,)
+                    ) if not pid_alive(pid)
+                ]
+                connection.executemany("DELETE FROM leases WHERE id = ?", [(lease_id,) for lease_id in dead])
+                in_flight -= len(dead)
+            if in_flight >= limits.max_concurrent:
+                return Decision(False, "concurrency", RATE_LIMIT_CONCURRENCY_RETRY_AFTER)
+
+        if limits.rate:
+            row = connection.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (limits.name,)).fetchone()
+            tokens, updated = row if row is not None else (limits.burst, now)
+            tokens = min(limits.burst, tokens + max(now - updated, 0) * limits.rate)
+            if tokens < 1:
+                connection.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (limits.name, tokens, now)
+                )
+                return Decision(False, "rate", max(math.ceil((1 - tokens) / limits.rate), 1))
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (limits.name, tokens - 1, now)
+            )
+
+        lease_id = None
+        if limits.max_concurrent:
+            lease_id = connection.execute(
+                "INSERT INTO leases (key, pid, expires) VALUES (?, ?, ?)",
+                (limits.name, os.getpid(), now + RATE_LIMIT_LEASE_SECONDS),
+            ).lastrowid
+        return Decision(True, lease_id=lease_id)
+
+    def _in_flight(self, connection, name):
+        return connection.execute("SELECT COUNT(*) FROM leases WHERE key = ?", (name,)).fetchone()[0]
+
+    def _count(self, connection, name, counter):
+        connection.execute(
+            "INSERT INTO usage (key, counter, count) VALUES (?, ?, 1) "
+            "ON CONFLICT (key, counter) DO UPDATE SET count = count + 1",
+            (name, counter),
+        )
+
+    def _connection(self):
+        # One connection per thread, and never one inherited across a fork
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+
+rate_limiter = RateLimiter()
+
+
+def load_api_keys():
+    """
+    Map every accepted API key to its KeyLimits.
+
+    Keys come from API_KEYS (JSON) or the JSON file named by API_KEYS_FILE,
+    shaped like ``{"<key>": {"name": "acme", "rate": 2, "burst": 5,
+    "max_concurrent": 2}}``; omitted limits use the RATE_LIMIT_DEFAULT_*
+    values. API_KEY stays valid as the key named "default", and is the only
+    key when neither is set.
+    """
+    raw = os.getenv("API_KEYS")
+    if not raw and os.getenv("API_KEYS_FILE"):
+        with open(os.getenv("API_KEYS_FILE")) as file:
+            raw = file.read()
+    configured = json.loads(raw) if raw else {}
+
+    keys = {}
+    for index, (key, settings) in enumerate(configured.items(), start=1):
+        settings = settings or {}
+        keys[key] = KeyLimits(
+            settings.get("name") or f"key{index}",
+            settings.get("rate"),
+            settings.get("burst"),
+            settings.get("max_concurrent"),
+        )
+    if os.getenv("API_KEY") or not keys:
+        keys.setdefault(os.getenv("API_KEY", "ddfdddd"), KeyLimits("default"))
+    return keys
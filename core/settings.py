@@ -89,6 +89,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Web and job worker processes share this file; wait for locks instead of failing
+        "OPTIONS": {"timeout": 20},
     }
 }
 
@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ComparisonJob, ComparisonTask
+
+
+@admin.register(ComparisonJob)
+class ComparisonJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "total", "created_at", "completed_at")
+    list_filter = ("status",)
+
+
+@admin.register(ComparisonTask)
+class ComparisonTaskAdmin(admin.ModelAdmin):
+    list_display = ("job", "index", "status", "attempts", "status_code", "finished_at")
+    list_filter = ("status",)
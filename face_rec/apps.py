@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class FaceRecConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "face_rec"
+
+    def ready(self):
+        from core.rate_limit import rate_limiter
+        from .utils import metrics
+        from .utils.memory import collect_memory_metrics
+
+        metrics.register_collector(collect_memory_metrics)
+        metrics.register_collector(rate_limiter.collect_metrics)
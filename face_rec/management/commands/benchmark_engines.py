@@ -0,0 +1,129 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from face_rec.management.commands.calibrate_thresholds import load_labeled_dataset
+from face_rec.utils.calibration import error_rates, pair_distance_histograms
+
+
+def latency_summary(seconds):
+    """Mean and percentiles of a list of durations, in milliseconds."""
+    if not seconds:
+        return None
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "mean": round(float(milliseconds.mean()), 2),
+        "p50": round(float(np.percentile(milliseconds, 50)), 2),
+        "p95": round(float(np.percentile(milliseconds, 95)), 2),
+        "max": round(float(milliseconds.max()), 2),
+    }
+
+
+def accuracy_at(genuine, impostor, edges, threshold):
+    """FAR, FRR and accuracy over every pair when accepting distances up to ``threshold``."""
+    far, frr = error_rates(genuine, impostor)
+    index = min(max(int(np.searchsorted(edges, threshold, side="right")) - 2, 0), len(far) - 1)
+    genuine_pairs, impostor_pairs = int(genuine.sum()), int(impostor.sum())
+    correct = (1 - frr[index]) * genuine_pairs + (1 - far[index]) * impostor_pairs
+    return {
+        "threshold": threshold,
+        "far": float(far[index]),
+        "frr": float(frr[index]),
+        "accuracy": float(correct / max(genuine_pairs + impostor_pairs, 1)),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Run every recognition engine over a labeled dataset and report the per-image latency of "
+        "the path a single-face comparison serves, failure rate, and FAR/FRR/accuracy over all "
+        "pairs at each engine's own threshold."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", help="Directory with one sub-directory of face images per identity.")
+        parser.add_argument("--engines", nargs="+", default=None, help="Engines to benchmark (default: every installed one).")
+        parser.add_argument("--model", default=None, help="DeepFace model (default: the served one).")
+        parser.add_argument("--max-images", type=int, default=None, help="Only use the first this many images.")
+        parser.add_argument("--warmup", type=int, default=2, help="Images embedded before timing starts.")
+        parser.add_argument("--output", default=None, help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        from face_rec.utils.engines import ENGINES, engine_available, get_engine
+        from face_rec.utils.model_registry import model_registry
+
+        engines = options["engines"] or [name for name in ENGINES if engine_available(name)]
+        unavailable = [name for name in engines if not engine_available(name)]
+        if unavailable:
+            raise CommandError(f"Engine(s) {unavailable} are unknown or not installed. Known engines: {ENGINES}.")
+
+        samples = load_labeled_dataset(options["dataset"])[:options["max_images"]]
+        if len({label for _, label in samples}) < 2:
+            raise CommandError("The dataset needs at least two identities.")
+        self.stdout.write(f"Loaded {len(samples)} images of {len({label for _, label in samples})} identities.")
+
+        report = {}
+        for name in engines:
+            if name == "deepface":
+                # The served model is already warm after preload; another one is built on first use
+                handle = model_registry.preload() if options["model"] is None else None
+                engine = get_engine(name, options["model"] or handle.model_name, handle.model if handle else None)
+            else:
+                engine = get_engine(name)
+            summary = report[engine.model_name] = self.benchmark(engine, samples, options["warmup"])
+
+            latency = summary["latency_ms"]
+            at_threshold = summary["at_engine_threshold"]
+            self.stdout.write(
+                f"{engine.model_name}: {latency['p50'] if latency else '-'}ms p50 per image, "
+                f"{summary['failed_images']} failed, accuracy {at_threshold['accuracy']:.4f} "
+                f"(FAR {at_threshold['far']:.5f} / FRR {at_threshold['frr']:.5f})"
+            )
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output)
+
+    def benchmark(self, engine, samples, warmup):
+        """Time the served embedding of every sample with one engine, then score every pair."""
+        for path, _ in samples[:warmup]:
+            try:
+                engine.represent(path)
+            except Exception:
+                pass
+
+        seconds, embeddings, labels, failures = [], [], [], {}
+        for path, label in samples:
+            started = time.perf_counter()
+            try:
+                # For DeepFace this is MTCNN alignment and DeepFace.represent, as compare_faces runs it
+                embedding = engine.represent(path)
+            except Exception as e:
+                reason = getattr(e, "check", type(e).__name__)
+                failures[reason] = failures.get(reason, 0) + 1
+                continue
+            seconds.append(time.perf_counter() - started)
+            embeddings.append(embedding)
+            labels.append(label)
+
+        if len(set(labels)) < 2:
+            raise CommandError(f"{engine.model_name} embedded fewer than two identities; nothing to score.")
+        genuine, impostor, edges = pair_distance_histograms(embeddings, labels)
+        far, frr = error_rates(genuine, impostor)
+        eer_index = int(np.argmin(np.abs(far - frr)))
+        return {
+            "engine": engine.name,
+            "model": engine.model_name,
+            "images": len(samples),
+            "failed_images": sum(failures.values()),
+            "failures": failures,
+            "latency_ms": latency_summary(seconds),
+            "pairs": {"genuine": int(genuine.sum()), "impostor": int(impostor.sum())},
+            "at_engine_threshold": accuracy_at(genuine, impostor, edges, engine.threshold),
+            "eer": {"rate": float((far[eer_index] + frr[eer_index]) / 2), "distance": float(edges[eer_index + 1])},
+        }
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from face_rec.utils.calibration import (
+    CALIBRATION_FILE,
+    UnattainableFarError,
+    build_calibration,
+    load_calibration_tables,
+    pair_distance_histograms,
+)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def load_labeled_dataset(dataset_dir):
+    """Collect ``(path, label)`` pairs from a directory with one sub-directory per identity."""
+    samples = []
+    for label in sorted(os.listdir(dataset_dir)):
+        identity_dir = os.path.join(dataset_dir, label)
+        if not os.path.isdir(identity_dir):
+            continue
+        for filename in sorted(os.listdir(identity_dir)):
+            if os.path.splitext(filename)[-1].lower() in IMAGE_EXTENSIONS:
+                samples.append((os.path.join(identity_dir, filename), label))
+    return samples
+
+
+class Command(BaseCommand):
+    help = (
+        "Embed a labeled dataset once per model, compute every genuine and impostor distance "
+        "and write per-model thresholds and confidence tables for FaceComparisonView."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", help="Directory with one sub-directory of face images per identity.")
+        parser.add_argument(
+            "--models", nargs="+", default=None,
+            help="Models to calibrate (default: all DeepFace models); face_recognition calibrates that engine.",
+        )
+        parser.add_argument(
+            "--target-far", nargs="+", type=float, default=[0.0001, 0.001, 0.01],
+            help="False accept rates to report thresholds for.",
+        )
+        parser.add_argument(
+            "--operating-far", type=float, default=0.001,
+            help="False accept rate at which a pair stops being a match at serving time.",
+        )
+        parser.add_argument(
+            "--threshold-confidence", type=int, default=None,
+            help="Confidence level reported at the operating threshold (default: FIXED_THRESHOLD).",
+        )
+        parser.add_argument("--block-size", type=int, default=1024, help="Rows per distance matrix block.")
+        parser.add_argument("--output", default=CALIBRATION_FILE, help="Calibration file to write or update.")
+
+    def handle(self, *args, **options):
+        # Heavy imports stay inside the command so `manage.py help` remains fast
+        from deepface import DeepFace
+        from face_rec.utils.comparison_service import FIXED_THRESHOLD
+        from face_rec.utils.deepface_service import MODELS, process_image
+        from face_rec.utils.engines import FaceRecognitionEngine, engine_available
+        from face_rec.utils.quality import ImageQualityError
+
+        models = options["models"] or MODELS
+        threshold_confidence = options["threshold_confidence"]
+        if threshold_confidence is None:
+            threshold_confidence = FIXED_THRESHOLD
+        unknown = [name for name in models if name not in MODELS and name != FaceRecognitionEngine.name]
+        if unknown:
+            raise CommandError(f"Invalid model(s) {unknown}. Must be among {MODELS + [FaceRecognitionEngine.name]}.")
+        if FaceRecognitionEngine.name in models and not engine_available(FaceRecognitionEngine.name):
+            raise CommandError("Calibrating face_recognition needs the optional face-recognition package.")
+
+        samples = load_labeled_dataset(options["dataset"])
+        if len({label for _, label in samples}) < 2:
+            raise CommandError("The dataset needs at least two identities.")
+        self.stdout.write(f"Loaded {len(samples)} images of {len({label for _, label in samples})} identities.")
+
+        # Align every image once with the serving pipeline; the crops are shared by all models
+        aligned = []
+        for path, label in samples:
+            try:
+                success, aligned_path = process_image(path)
+            except ImageQualityError as e:
+                # Serving rejects these before embedding, so they never produce a distance
+                self.stderr.write(f"Skipping {path}: {e}")
+                continue
+            aligned.append((aligned_path if success else path, label, success, path))
+
+        tables = load_calibration_tables(options["output"])
+        unattainable = []
+        try:
+            for name in models:
+                started = time.time()
+                embeddings, labels = [], []
+                for path, label, _, original_path in aligned:
+                    try:
+                        if name == FaceRecognitionEngine.name:
+                            # The engine detects and aligns on its own, from the original image
+                            embeddings.append(FaceRecognitionEngine().represent(original_path))
+                        else:
+                            representation = DeepFace.represent(img_path=path, model_name=name, enforce_detection=False)
+                            embeddings.append(representation[0]["embedding"])
+                    except Exception as e:
+                        self.stderr.write(f"Skipping {path} for {name}: {e}")
+                        continue
+                    labels.append(label)
+
+                genuine, impostor, edges = pair_distance_histograms(embeddings, labels, options["block_size"])
+                try:
+                    table = build_calibration(
+                        genuine,
+                        impostor,
+                        edges,
+                        options["target_far"],
+                        options["operating_far"],
+                        threshold_confidence,
+                    )
+                except UnattainableFarError as e:
+                    # Serving such a table would accept more impostors than asked for; keep the old one
+                    self.stderr.write(f"{name}: {e}")
+                    unattainable.append(name)
+                    continue
+                table["images"] = len(embeddings)
+                table["created_at"] = datetime.now(timezone.utc).isoformat()
+                tables[name] = table
+
+                operating = table["operating_point"]
+                self.stdout.write(
+                    f"{name}: threshold {operating['distance']:.4f} at FAR {operating['far']:.5f} / "
+                    f"FRR {operating['frr']:.5f}, EER {table['eer']['rate']:.5f} "
+                    f"({time.time() - started:.1f}s)"
+                )
+        finally:
+            for path, _, success, _ in aligned:
+                if success:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+        calibrated = len(models) - len(unattainable)
+        if calibrated:
+            with open(options["output"], "w") as file:
+                json.dump(tables, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote calibration for {calibrated} model(s) to {options['output']}"))
+        if unattainable:
+            raise CommandError(
+                f"Not calibrated: {unattainable} cannot reach a FAR of {options['operating_far']} on this dataset."
+            )
@@ -0,0 +1,194 @@
+import os
+import csv
+import json
+import time
+import shutil
+import signal
+import tempfile
+import threading
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+IMAGE_FIELDS = ("image1", "image2")
+LOCAL_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+def read_pairs(path, input_format):
+    """Yield ``(id, pair)`` from a CSV with a header row or from JSONL; rows without an id are numbered."""
+    with open(path, newline="") as file:
+        if input_format == "csv":
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for number, row in enumerate(rows, start=1):
+            if not all(row.get(field) for field in IMAGE_FIELDS):
+                raise CommandError(f"{path}: pair {number} has no image1/image2 values.")
+            pair_id = str(row.get("id") or number)
+            multi_face = str(row.get("multi_face", "")).lower() in ("1", "true", "yes")
+            pair = {"image1": row["image1"], "image2": row["image2"], "multi_face": multi_face, "engine": row.get("engine") or None}
+            yield pair_id, pair
+
+
+def read_checkpoint(path, retry_errors=False):
+    """
+    Return the ids already present in the output file.
+
+    A line cut short by an interruption is truncated away so appending
+    resumes on a clean line. With ``retry_errors`` pairs that failed with
+    an unexpected error (status code 500) are compared again.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid_length = 0
+    with open(path, "rb") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            valid_length += len(line)
+            if retry_errors and record.get("statusCode") == 500:
+                done.discard(record["id"])
+            else:
+                done.add(record["id"])
+    if valid_length != os.path.getsize(path):
+        with open(path, "r+b") as file:
+            file.truncate(valid_length)
+    return done
+
+
+def copy_local_image(path):
+    """Copy a local image to a temporary file, since the comparison removes its inputs."""
+    extension = os.path.splitext(path)[-1].lower()
+    if extension not in LOCAL_IMAGE_EXTENSIONS:
+        raise ValueError(f"Unsupported file format: {extension}")
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=extension)
+    with open(path, "rb") as source, temp_file:
+        shutil.copyfileobj(source, temp_file)
+    return temp_file.name
+
+
+def init_worker():
+    """Load the model once per pool process; the parent handles Ctrl+C."""
+    from face_rec.utils.model_registry import model_registry
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    model_registry.preload()
+
+
+def compare_pair(task):
+    """Compare one pair in a pool process and return its output record."""
+    from face_rec.utils.comparison_service import compare_image_inputs, compare_validated_images
+
+    pair_id, pair = task
+    started = time.time()
+    try:
+        if all(os.path.isfile(pair[field]) for field in IMAGE_FIELDS):
+            # Local files skip the API's download and upload size checks
+            validated_data = dict(pair)
+            validated_data["image1_temp_path"] = copy_local_image(pair["image1"])
+            try:
+                validated_data["image2_temp_path"] = copy_local_image(pair["image2"])
+            except Exception:
+                os.remove(validated_data["image1_temp_path"])
+                raise
+            payload, status_code = compare_validated_images(validated_data)
+        else:
+            payload, status_code = compare_image_inputs(
+                pair["image1"], pair["image2"], multi_face=pair["multi_face"], engine=pair["engine"], compact=pair["compact"]
+            )
+    except Exception as e:
+        payload, status_code = {"status": False, "reason": f"{type(e).__name__}: {e}"}, 500
+    return {"id": pair_id, "statusCode": status_code, "elapsed": round(time.time() - started, 3), **payload}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare image pairs from a CSV or JSONL file offline with a pool of worker processes, "
+        "streaming one JSON result per line. Rerunning with the same output resumes after "
+        "the pairs it already holds."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "pairs",
+            help="CSV with a header row, or JSONL, with image1 and image2 (URL, Base64 or local path) "
+            "and optional id, multi_face and engine columns.",
+        )
+        parser.add_argument("--output", required=True, help="JSONL file results are appended to; also the checkpoint.")
+        parser.add_argument("--format", choices=["csv", "jsonl"], default=None, help="Input format (default: from the extension).")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes, each with its own model.")
+        parser.add_argument("--fsync-every", type=int, default=50, help="Flush results to disk every this many pairs.")
+        parser.add_argument(
+            "--retry-errors", action="store_true",
+            help="On resume, compare again the pairs that failed with an unexpected error.",
+        )
+        parser.add_argument(
+            "--echo-images", action="store_true",
+            help="Repeat image1 and image2 in every result as sent, instead of their SHA-256 hashes.",
+        )
+
+    def handle(self, *args, **options):
+        input_format = options["format"] or ("jsonl" if options["pairs"].lower().endswith((".jsonl", ".json")) else "csv")
+        workers = max(options["workers"], 1)
+        done = read_checkpoint(options["output"], options["retry_errors"])
+        if done:
+            self.stdout.write(f"Resuming: {len(done)} pairs already in {options['output']}")
+
+        # Bound the pairs handed to the pool so large inputs are streamed, not loaded
+        in_flight = threading.BoundedSemaphore(workers * 4)
+        stopping = threading.Event()
+        skipped = 0
+
+        def pending_pairs():
+            nonlocal skipped
+            for pair_id, pair in read_pairs(options["pairs"], input_format):
+                if pair_id in done:
+                    skipped += 1
+                    continue
+                while not in_flight.acquire(timeout=0.5):
+                    if stopping.is_set():
+                        return
+                # Base64 inputs would otherwise be copied into every output line
+                pair["compact"] = not options["echo_images"]
+                yield pair_id, pair
+
+        # Forked children must not share the parent's database connection
+        connections.close_all()
+        compared = failed = 0
+        started = time.monotonic()
+        pool = Pool(workers, initializer=init_worker)
+        try:
+            with open(options["output"], "a") as output:
+                try:
+                    for record in pool.imap_unordered(compare_pair, pending_pairs()):
+                        in_flight.release()
+                        output.write(json.dumps(record) + "\n")
+                        compared += 1
+                        failed += record["statusCode"] != 200
+                        if compared % options["fsync_every"] == 0:
+                            output.flush()
+                            os.fsync(output.fileno())
+                            self.stdout.write(f"{compared} pairs compared ({compared / (time.monotonic() - started):.2f}/s)")
+                finally:
+                    output.flush()
+                    os.fsync(output.fileno())
+            pool.close()
+        except KeyboardInterrupt:
+            stopping.set()
+            pool.terminate()
+            self.stdout.write(f"Interrupted after {compared} pairs; rerun the same command to resume.")
+            return
+        finally:
+            pool.join()
+
+        self.stdout.write(
+            f"Compared {compared} pairs ({failed} not successful), skipped {skipped} already done, "
+            f"in {time.monotonic() - started:.1f} seconds."
+        )
@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
+
+# Snippet run by every child for the Python-level entry points
+SETUP = "import os, django; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings'); django.setup()"
+
+ENTRY_POINTS = {
+    "check": [sys.executable, "manage.py", "check"],
+    "migrate": [sys.executable, "manage.py", "migrate", "--plan"],
+    "collectstatic": [sys.executable, "manage.py", "collectstatic", "--dry-run", "--noinput"],
+    "wsgi": [sys.executable, "-c", "import core.wsgi"],
+    "urlconf": [sys.executable, "-c", f"{SETUP}; import core.urls"],
+    "swagger": [
+        sys.executable, "-c",
+        f"{SETUP}; from django.test import Client; "
+        "assert Client().get('/', HTTP_HOST='localhost').status_code == 200",
+    ],
+    "health": [
+        sys.executable, "-c",
+        f"{SETUP}; from django.test import Client; "
+        "assert Client().get('/api/health', HTTP_HOST='localhost').status_code == 200",
+    ],
+    "preload": [
+        sys.executable, "-c",
+        f"{SETUP}; from face_rec.utils.model_registry import model_registry; model_registry.preload()",
+    ],
+}
+
+
+def measure(command, env):
+    """Run ``command`` to completion and return its wall time and peak RSS."""
+    with tempfile.TemporaryFile() as stderr:
+        started = time.monotonic()
+        process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+        # wait4 reports the resource usage of this child alone
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.monotonic() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr.seek(0)
+        errors = stderr.read().decode(errors="replace").strip().splitlines()
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return {
+        "seconds": round(elapsed, 3),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+        "exit_code": process.returncode,
+        "stderr_tail": errors[-3:] if process.returncode else [],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Start each entry point (manage.py check, migrate, collectstatic, the WSGI app, the "
+        "API docs, the health check, model preload) in a fresh process and report its start "
+        "time and peak RSS."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--entry-points", nargs="+", default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS),
+            help="Entry points to measure (default: all).",
+        )
+        parser.add_argument("--repeat", type=int, default=1, help="Runs per entry point; the fastest run is reported.")
+        parser.add_argument("--output", default=None, help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1.")
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": "core.settings"}
+
+        report = {}
+        for name in options["entry_points"]:
+            runs = [measure(ENTRY_POINTS[name], env) for _ in range(options["repeat"])]
+            best = min(runs, key=lambda run: run["seconds"])
+            report[name] = best
+            self.stdout.write(f"{name:<14} {best['seconds']:>8.2f}s {best['peak_rss_mb']:>9.1f}MB")
+            for line in best["stderr_tail"]:
+                self.stderr.write(f"  {name} exited with {best['exit_code']}: {line}")
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output)
@@ -0,0 +1,239 @@
+import os
+import json
+import math
+import time
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.core.management.base import BaseCommand, CommandError
+
+IMAGE_FIELDS = ("image1", "image2")
+STUB_CHUNK_SIZE = 16 * 1024
+
+
+def load_recording(path):
+    """Read recorded compare requests; each JSONL line is a request body, optionally wrapped in "body"."""
+    recorded = []
+    with open(path) as file:
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            body = entry.get("body", entry)
+            if isinstance(body, str):
+                body = json.loads(body)
+            if not all(field in body for field in IMAGE_FIELDS):
+                raise CommandError(f"{path}:{line_number} has no image1/image2 fields.")
+            recorded.append({field: body[field] for field in IMAGE_FIELDS})
+    if not recorded:
+        raise CommandError(f"{path} contains no requests.")
+    return recorded
+
+
+def rewrite_image_urls(body, stub_base_url):
+    """Point URL images at the stub server, which serves them by file name."""
+    rewritten = dict(body)
+    for field in IMAGE_FIELDS:
+        value = rewritten[field]
+        if value.startswith(("http://", "https://")):
+            rewritten[field] = f"{stub_base_url}/{os.path.basename(urlsplit(value).path)}"
+    return rewritten
+
+
+def make_stub_handler(images_dir, latency, bandwidth):
+    """Build a request handler that serves ``images_dir`` with added latency and limited bandwidth."""
+
+    class StubImageHandler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=images_dir, **kwargs)
+
+        def copyfile(self, source, outputfile):
+            while True:
+                chunk = source.read(STUB_CHUNK_SIZE)
+                if not chunk:
+                    break
+                outputfile.write(chunk)
+                if bandwidth:
+                    time.sleep(len(chunk) / bandwidth)
+
+        def send_head(self):
+            if latency:
+                time.sleep(latency)
+            return super().send_head()
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubImageHandler
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(max(math.ceil(fraction * len(sorted_values)) - 1, 0), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class ReplayStats:
+    """Thread-safe collection of request outcomes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.status_codes = Counter()
+        self.errors = Counter()
+
+    def record(self, latency, status_code=None, error=None):
+        with self.lock:
+            self.latencies.append(latency)
+            if error is not None:
+                self.errors[error] += 1
+            else:
+                self.status_codes[status_code] += 1
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        total = len(latencies)
+        failed = sum(self.errors.values()) + sum(
+            count for code, count in self.status_codes.items() if not 200 <= code < 300
+        )
+        return {
+            "requests": total,
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_rps": round(total / elapsed, 3) if elapsed else None,
+            "error_rate": round(failed / total, 4) if total else None,
+            "status_codes": {str(code): count for code, count in sorted(self.status_codes.items())},
+            "errors": dict(self.errors),
+            "latency_seconds": {
+                "min": latencies[0] if latencies else None,
+                "p50": percentile(latencies, 0.50),
+                "p90": percentile(latencies, 0.90),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "max": latencies[-1] if latencies else None,
+                "mean": sum(latencies) / total if total else None,
+            },
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay recorded compare requests against a running instance at a fixed concurrency or "
+        "arrival rate, serving the referenced images from a local stub server, and report "
+        "throughput, latency percentiles and error rates."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("recording", help="JSONL file with one recorded compare request body per line.")
+        parser.add_argument("--target", default="http://127.0.0.1:8000/api/compare", help="Compare endpoint to load.")
+        parser.add_argument("--api-key", default=os.getenv("API_KEY", "ddfdddd"), help="X-API-Key sent with every request.")
+        parser.add_argument("--concurrency", type=int, default=4, help="Requests kept in flight (the cap on in-flight requests with --rate).")
+        parser.add_argument(
+            "--rate", type=float, default=None,
+            help="Open loop: Poisson arrivals per second instead of a fixed concurrency.",
+        )
+        parser.add_argument("--requests", type=int, default=None, help="Stop after this many requests.")
+        parser.add_argument("--duration", type=float, default=60.0, help="Stop after this many seconds.")
+        parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request in seconds.")
+        parser.add_argument("--images-dir", default=None, help="Serve URL images from this directory through the stub server.")
+        parser.add_argument("--stub-bind", default="0.0.0.0", help="Address the stub image server listens on.")
+        parser.add_argument("--stub-host", default="127.0.0.1", help="Host name the service uses to reach the stub.")
+        parser.add_argument("--stub-port", type=int, default=8765)
+        parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="Delay before the stub answers.")
+        parser.add_argument("--stub-bandwidth-kbps", type=float, default=0.0, help="Stub bandwidth per download in KB/s (0 is unlimited).")
+        parser.add_argument("--seed", type=int, default=None, help="Seed for request order and arrival times.")
+        parser.add_argument("--output", default=None, help="Also write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        recorded = load_recording(options["recording"])
+        randomizer = random.Random(options["seed"])
+
+        stub_server = None
+        if options["images_dir"]:
+            handler = make_stub_handler(
+                options["images_dir"],
+                options["stub_latency_ms"] / 1000.0,
+                options["stub_bandwidth_kbps"] * 1024,
+            )
+            stub_server = ThreadingHTTPServer((options["stub_bind"], options["stub_port"]), handler)
+            stub_server.daemon_threads = True
+            threading.Thread(target=stub_server.serve_forever, daemon=True).start()
+            stub_base_url = f"http://{options['stub_host']}:{options['stub_port']}"
+            recorded = [rewrite_image_urls(body, stub_base_url) for body in recorded]
+            self.stdout.write(f"Serving {options['images_dir']} on {stub_base_url}")
+
+        session = requests.Session()
+        session.headers.update({"X-API-Key": options["api_key"]})
+        adapter = HTTPAdapter(pool_maxsize=max(options["concurrency"], 10))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        stats = ReplayStats()
+
+        def send(body, scheduled_at):
+            # Latency counts from the scheduled start so queueing in the client is not hidden
+            try:
+                response = session.post(options["target"], json=body, timeout=options["timeout"])
+                stats.record(time.monotonic() - scheduled_at, status_code=response.status_code)
+            except requests.RequestException as e:
+                stats.record(time.monotonic() - scheduled_at, error=type(e).__name__)
+
+        started = time.monotonic()
+        deadline = started + options["duration"]
+        limit = options["requests"]
+        try:
+            if options["rate"]:
+                self.run_open_loop(send, recorded, randomizer, options["rate"], options["concurrency"], deadline, limit)
+            else:
+                self.run_closed_loop(send, recorded, randomizer, options["concurrency"], deadline, limit)
+        finally:
+            if stub_server is not None:
+                stub_server.shutdown()
+
+        report = stats.report(time.monotonic() - started)
+        report["mode"] = f"rate={options['rate']}/s" if options["rate"] else f"concurrency={options['concurrency']}"
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output)
+
+    def run_closed_loop(self, send, recorded, randomizer, concurrency, deadline, limit):
+        """Keep ``concurrency`` requests in flight until the deadline or the request limit."""
+        counter = iter(range(limit)) if limit else None
+        counter_lock = threading.Lock()
+
+        def loop():
+            while time.monotonic() < deadline:
+                with counter_lock:
+                    if counter is not None and next(counter, None) is None:
+                        return
+                    body = randomizer.choice(recorded)
+                send(body, time.monotonic())
+
+        threads = [threading.Thread(target=loop, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open_loop(self, send, recorded, randomizer, rate, max_in_flight, deadline, limit):
+        """Issue requests with exponential inter-arrival times, independent of response times."""
+        with ThreadPoolExecutor(max_workers=max(max_in_flight, 1)) as executor:
+            sent = 0
+            next_arrival = time.monotonic()
+            while next_arrival < deadline and (limit is None or sent < limit):
+                delay = next_arrival - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(send, randomizer.choice(recorded), next_arrival)
+                sent += 1
+                next_arrival += randomizer.expovariate(rate)
@@ -0,0 +1,66 @@
+import time
+import signal
+from multiprocessing import Process
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def worker_main(worker_number, poll_interval, stop_after_idle):
+    """Entry point of a worker process; each process loads its own copy of the model."""
+    from face_rec.utils.job_queue import run_worker
+    from face_rec.utils.model_registry import model_registry
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor handles Ctrl+C
+    model_registry.preload()
+    run_worker(poll_interval=poll_interval, stop_after_idle=stop_after_idle)
+
+
+class Command(BaseCommand):
+    help = "Process queued comparison jobs with a pool of worker processes."
+    # System checks import the URLconf and with it the model; keep that out of the parent process
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Number of worker processes.")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument(
+            "--stop-after-idle",
+            type=float,
+            default=None,
+            help="Exit once the queue stayed empty for this many seconds instead of running forever.",
+        )
+
+    def handle(self, *args, **options):
+        worker_args = (options["poll_interval"], options["stop_after_idle"])
+        # Forked children must not share the parent's database connection
+        connections.close_all()
+
+        processes = {}
+        for number in range(options["workers"]):
+            processes[number] = self.start_worker(number, worker_args)
+
+        try:
+            while processes:
+                time.sleep(1)
+                for number, process in list(processes.items()):
+                    if process.is_alive():
+                        continue
+                    if process.exitcode == 0:
+                        # Worker drained the queue (--stop-after-idle)
+                        del processes[number]
+                        continue
+                    self.stderr.write(f"Worker {number} exited with code {process.exitcode}, restarting it.")
+                    processes[number] = self.start_worker(number, worker_args)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers...")
+            for process in processes.values():
+                process.terminate()
+            for process in processes.values():
+                process.join()
+
+    def start_worker(self, number, worker_args):
+        process = Process(target=worker_main, args=(number, *worker_args), daemon=True)
+        process.start()
+        self.stdout.write(f"Started comparison worker {number} (pid {process.pid})")
+        return process
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.5 on 2026-10-19 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('face_rec', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comparisontask',
+            name='compact',
+            field=models.BooleanField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='comparisontask',
+            name='engine',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='comparisontask',
+            name='multi_face',
+            field=models.BooleanField(default=False),
+        ),
+    ]
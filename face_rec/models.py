@@ -1,3 +1,74 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
+
+
+class ComparisonJob(models.Model):
+    """A batch of face comparisons that is processed by the background job workers."""
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETED, "Completed"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    total = models.PositiveIntegerField(default=0)
+    callback_url = models.URLField(max_length=2048, blank=True, default="")
+    callback_status = models.CharField(max_length=255, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
+
+
+class ComparisonTask(models.Model):
+    """A single image pair inside a ComparisonJob."""
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    job = models.ForeignKey(ComparisonJob, on_delete=models.CASCADE, related_name="tasks")
+    index = models.PositiveIntegerField()
+    image1 = models.TextField()
+    image2 = models.TextField()
+    # Per-comparison options, as accepted by the synchronous compare endpoint
+    multi_face = models.BooleanField(default=False)
+    engine = models.CharField(max_length=32, blank=True, default="")
+    compact = models.BooleanField(null=True, blank=True, default=None)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=64, blank=True, default="")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["job", "index"]
+        constraints = [
+            models.UniqueConstraint(fields=["job", "index"], name="unique_comparison_task_index"),
+        ]
 
-# Create your models here.
+    def __str__(self):
+        return f"{self.job_id}#{self.index} ({self.status})"
@@ -1,14 +1,96 @@
 import re
 import base64
+import http.client
+import urllib.error
 import urllib.request
 import tempfile
 import requests
 import os
 from rest_framework import serializers
 
+from .utils.deadline import DeadlineExceeded, check_deadline
+from .utils.deepface_service import MODELS
+from .utils.engines import ENGINES, engine_available
+from .utils.job_queue import JOB_MAX_COMPARISONS
+from .utils.singleflight import SingleFlight
+
+image_downloads = SingleFlight("download")
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class TransientDownloadError(Exception):
+    """A download failed for a reason that may go away on retry, such as a timeout or an HTTP 503."""
+
+
+def is_transient_download_error(error):
+    """Whether retrying a failed download may succeed: timeouts, connection failures, HTTP 408, 429 and 5xx."""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in (408, 429) or error.code >= 500
+    return isinstance(error, (urllib.error.URLError, TimeoutError, ConnectionError, http.client.HTTPException))
+
+
+class ImageTooLargeError(Exception):
+    """A download went past its size limit; reading stopped at the first byte over it."""
+
+
+def fetch_image(image_url, deadline=None, max_bytes=None):
+    """
+    Download an image into memory, giving up when ``deadline`` runs out.
+
+    With ``max_bytes`` at most ``max_bytes + 1`` bytes are read before
+    ``ImageTooLargeError`` is raised, whatever the server claims or sends.
+    """
+    timeout = deadline.timeout() if deadline is not None else None
+    check_deadline(deadline, "download")
+    # The socket timeout bounds each read; the deadline bounds the whole download
+    options = {} if timeout is None else {"timeout": max(timeout, 0.001)}
+    chunks = []
+    size = 0
+    try:
+        with urllib.request.urlopen(image_url, **options) as response:
+            declared_size = response.headers.get("Content-Length", "")
+            if max_bytes is not None and declared_size.isdigit() and int(declared_size) > max_bytes:
+                raise ImageTooLargeError(f"{image_url} is {declared_size} bytes, more than {max_bytes}")
+            while True:
+                check_deadline(deadline, "download")
+                chunk_size = DOWNLOAD_CHUNK_SIZE if max_bytes is None else min(DOWNLOAD_CHUNK_SIZE, max_bytes + 1 - size)
+                chunk = response.read1(chunk_size)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise ImageTooLargeError(f"{image_url} is more than {max_bytes} bytes")
+    except OSError:
+        # A socket timeout cut short by this download's own deadline, which requests sharing it may not have hit
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded("download")
+        raise
+
+
 class FaceComparisonSerializer(serializers.Serializer):
     image1 = serializers.CharField(required=True)
     image2 = serializers.CharField(required=True)
+    multi_face = serializers.BooleanField(
+        required=False,
+        default=False,
+        help_text="Compare every detected face of both images and return the best-matching pair.",
+    )
+    engine = serializers.ChoiceField(
+        choices=ENGINES,
+        required=False,
+        allow_null=True,
+        default=None,
+        help_text="Recognition engine to compare with (default: FACE_ENGINE). face_recognition is cheaper on CPU.",
+    )
+    compact = serializers.BooleanField(
+        required=False,
+        allow_null=True,
+        default=None,
+        help_text="Return SHA-256 hashes of image1 and image2 instead of echoing them (default: COMPACT_RESPONSES).",
+    )
 
     MAX_FILE_SIZE_MB = 1  # Maximum allowed size in MB
 
@@ -34,6 +116,11 @@ class FaceComparisonSerializer(serializers.Serializer):
                 {field_name: "The provided value must be either a valid URL or a Base64-encoded image."}
             )
 
+    def validate_engine(self, value):
+        if value is not None and not engine_available(value):
+            raise serializers.ValidationError(f"The {value} engine is not installed on this server.")
+        return value
+
     def validate_file_size(self, file_path, field_name):
         """Validate that the file size does not exceed the allowed limit."""
         file_size_mb = os.path.getsize(file_path) / (1024 * 1024)  # Convert bytes to MB
@@ -50,14 +137,40 @@ class FaceComparisonSerializer(serializers.Serializer):
             if file_extension not in supported_formats:
                 raise serializers.ValidationError(f"Unsupported file format: {file_extension}")
 
-            # Create a temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension)
+            # Concurrent requests for the same URL share a single download
+            deadline = self.context.get("deadline")
+            while True:
+                try:
+                    image_data, _ = image_downloads.do(
+                        image_url,
+                        lambda: fetch_image(image_url, deadline, self.MAX_FILE_SIZE_MB * 1024 * 1024),
+                        timeout=deadline.timeout() if deadline is not None else None,
+                    )
+                    break
+                except DeadlineExceeded:
+                    if deadline is not None and deadline.expired():
+                        raise
+                    # The shared download belonged to a request with less time left; run it again for this one
+                except Exception:
+                    # Waiting on a shared download outlasted this request's budget
+                    if deadline is not None and deadline.expired():
+                        raise DeadlineExceeded("download")
+                    raise
 
-            # Download the image directly into the temporary file
-            urllib.request.urlretrieve(image_url, temp_file.name)
+            # Every request gets its own temporary file, since each one cleans up after itself
+            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension)
+            with open(temp_file.name, "wb") as file:
+                file.write(image_data)
 
             return temp_file.name
+        except DeadlineExceeded:
+            raise
+        except ImageTooLargeError:
+            raise serializers.ValidationError(f"The file size must not exceed {self.MAX_FILE_SIZE_MB}MB.")
         except Exception as e:
+            # Job workers retry these later instead of storing a 400 for good
+            if self.context.get("raise_transient_errors") and is_transient_download_error(e):
+                raise TransientDownloadError(f"Failed to download {image_url}: {e}") from e
             raise serializers.ValidationError(f"Failed to download the image from URL")
 
     def decode_base64_image(self, base64_str):
@@ -95,16 +208,21 @@ class FaceComparisonSerializer(serializers.Serializer):
         # Validate image1 size
         self.validate_file_size(image1_temp_path, "image1")
 
-        if image2_type == "url":
-            try:
-                image2_temp_path = self.download_image_to_temp_file(data.get("image2"))
-            except serializers.ValidationError as e:
-                raise serializers.ValidationError({"image2": str(e)})
-        else:
-            try:
-                image2_temp_path = self.decode_base64_image(data.get("image2"))
-            except serializers.ValidationError as e:
-                raise serializers.ValidationError({"image2": str(e)})
+        try:
+            if image2_type == "url":
+                try:
+                    image2_temp_path = self.download_image_to_temp_file(data.get("image2"))
+                except serializers.ValidationError as e:
+                    raise serializers.ValidationError({"image2": str(e)})
+            else:
+                try:
+                    image2_temp_path = self.decode_base64_image(data.get("image2"))
+                except serializers.ValidationError as e:
+                    raise serializers.ValidationError({"image2": str(e)})
+        except Exception:
+            # Nobody else knows about image1's file yet
+            os.remove(image1_temp_path)
+            raise
 
         # Validate image2 size
         self.validate_file_size(image2_temp_path, "image2")
@@ -116,3 +234,34 @@ class FaceComparisonSerializer(serializers.Serializer):
         data["image2"] = data.get("image2")
 
         return data
+
+
+class ComparisonJobItemSerializer(FaceComparisonSerializer):
+    """A single image pair of a comparison job; images are only fetched by the job workers."""
+
+    def validate(self, data):
+        self.validate_image_format(data.get("image1"), "image1")
+        self.validate_image_format(data.get("image2"), "image2")
+        return data
+
+
+class ComparisonJobSerializer(serializers.Serializer):
+    comparisons = ComparisonJobItemSerializer(many=True, allow_empty=False)
+    callback_url = serializers.URLField(required=False, allow_blank=True, max_length=2048)
+
+    def validate_comparisons(self, value):
+        if len(value) > JOB_MAX_COMPARISONS:
+            raise serializers.ValidationError(
+                f"A job can contain at most {JOB_MAX_COMPARISONS} comparisons. Provided: {len(value)}."
+            )
+        return value
+
+
+class ModelConfigSerializer(serializers.Serializer):
+    model_name = serializers.ChoiceField(choices=MODELS, required=False)
+    fixed_threshold = serializers.IntegerField(min_value=0, max_value=100, required=False)
+
+    def validate(self, data):
+        if not data:
+            raise serializers.ValidationError("Provide model_name, fixed_threshold or both.")
+        return data
@@ -1,3 +1,367 @@
-from django.test import TestCase
+import io
+import os
+import sys
+import tempfile
+import threading
+import types
+import time
+import urllib.error
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIRequestFactory
+
+from core.rate_limit import Decision, load_api_keys
+
+from .management.commands.replay_traffic import percentile
+from .models import ComparisonTask
+from .serializers import FaceComparisonSerializer, ImageTooLargeError, fetch_image
+from .utils.admission import AdmissionController
+from .utils.calibration import (
+    HISTOGRAM_BINS,
+    HISTOGRAM_RANGE,
+    UnattainableFarError,
+    build_calibration,
+    threshold_for_far,
+    error_rates,
+)
+from .utils.comparison_service import calculate_confidence
+from .utils.deadline import Deadline, DeadlineExceeded, check_deadline
+from .utils.deepface_service import detect_face_crops
+from .utils.engines import DeepFaceEngine, FaceRecognitionEngine
+from .utils.job_queue import claim_next_task, enqueue_job, process_task
+from .utils.quality import ImageQualityError
+from .views import ComparisonJobDetailView, FaceComparisonView
+
+IMAGE1 = "https://example.com/image1.jpg"
+IMAGE2 = "https://example.com/image2.jpg"
+
+
+def http_error(code):
+    return urllib.error.HTTPError(IMAGE1, code, "error", {}, None)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.job = enqueue_job([{"image1": IMAGE1, "image2": IMAGE2}])
+
+    def test_transient_download_failure_is_retried(self):
+        task = claim_next_task("test-worker")
+        with mock.patch("face_rec.serializers.fetch_image", side_effect=http_error(503)):
+            process_task(task)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, ComparisonTask.STATUS_PENDING)
+        self.assertIsNone(task.result)
+        self.assertIn("503", task.error)
+
+    def test_permanent_download_failure_is_stored(self):
+        task = claim_next_task("test-worker")
+        with mock.patch("face_rec.serializers.fetch_image", side_effect=http_error(404)):
+            process_task(task)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, ComparisonTask.STATUS_DONE)
+        self.assertEqual(task.status_code, 400)
+
+    def test_stalled_download_is_bounded_and_retried(self):
+        def stalled_fetch(image_url, deadline=None, max_bytes=None):
+            while True:
+                time.sleep(0.01)
+                check_deadline(deadline, "download")
+
+        task = claim_next_task("test-worker")
+        with mock.patch("face_rec.utils.job_queue.JOB_TASK_DEADLINE_SECONDS", 0.05), \
+                mock.patch("face_rec.serializers.fetch_image", side_effect=stalled_fetch):
+            process_task(task)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, ComparisonTask.STATUS_PENDING)
+        self.assertIn("exceeded during download", task.error)
+
+    def test_task_options_reach_the_comparison(self):
+        job = enqueue_job([{"image1": IMAGE1, "image2": IMAGE2, "multi_face": True, "engine": "deepface", "compact": True}])
+        task = job.tasks.get()
+        self.assertEqual((task.multi_face, task.engine, task.compact), (True, "deepface", True))
+
+        with mock.patch("face_rec.serializers.fetch_image", return_value=b"image"), \
+                mock.patch("face_rec.utils.comparison_service.compare_validated_images", return_value=({}, 200)) as compare:
+            process_task(ComparisonTask.objects.select_related("job").get(id=task.id))
+        validated_data = compare.call_args[0][0]
+        os.remove(validated_data["image1_temp_path"])
+        os.remove(validated_data["image2_temp_path"])
+        self.assertEqual(
+            (validated_data["multi_face"], validated_data["engine"], validated_data["compact"]), (True, "deepface", True)
+        )
+
+    def test_job_detail_rejects_limit_below_one(self):
+        view = ComparisonJobDetailView.as_view()
+        for limit in ("0", "-1"):
+            request = APIRequestFactory().get(f"/api/jobs/{self.job.id}", {"limit": limit})
+            response = view(request, job_id=self.job.id)
+            self.assertEqual(response.status_code, 400)
+
+        request = APIRequestFactory().get(f"/api/jobs/{self.job.id}", {"limit": "1"})
+        self.assertEqual(view(request, job_id=self.job.id).status_code, 200)
+
+
+class PercentileTests(SimpleTestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.95), 95)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile(values, 1.0), 100)
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+
+class ConfidenceTests(SimpleTestCase):
+    calibration = {"threshold_confidence": 50, "confidence_table": {"distance": [0, 0.3, 2], "confidence": [100, 50, 0]}}
+
+    def test_served_threshold_applies_to_calibrated_models(self):
+        result = {"distance": 0.35, "model": "Facenet512"}
+        self.assertEqual(calculate_confidence(result, 50, self.calibration), (49, 50, False, "Image does not match"))
+        self.assertEqual(calculate_confidence(result, 40, self.calibration), (49, 40, True, "Images Match"))
+
+    def test_calibrated_threshold_keeps_the_calibrated_far(self):
+        random = np.random.RandomState(0)
+        genuine_distances = np.clip(random.normal(0.35, 0.1, 5000), *HISTOGRAM_RANGE)
+        impostor_distances = np.clip(random.normal(0.9, 0.12, 50000), *HISTOGRAM_RANGE)
+        edges = np.linspace(*HISTOGRAM_RANGE, HISTOGRAM_BINS + 1)
+        genuine = np.histogram(genuine_distances, bins=edges)[0]
+        impostor = np.histogram(impostor_distances, bins=edges)[0]
+        table = build_calibration(genuine, impostor, edges, [0.01], 0.001, 50)
+
+        with redirect_stdout(io.StringIO()):
+            accepted = [
+                calculate_confidence({"distance": float(distance)}, 50, table)[2] for distance in impostor_distances
+            ]
+            rejected = [
+                not calculate_confidence({"distance": float(distance)}, 50, table)[2] for distance in genuine_distances
+            ]
+        operating_point = table["operating_point"]
+        self.assertLessEqual(np.mean(accepted), operating_point["far"])
+        self.assertAlmostEqual(np.mean(rejected), operating_point["frr"], delta=0.001)
+
+    def test_unattainable_far_is_reported(self):
+        edges = np.linspace(*HISTOGRAM_RANGE, HISTOGRAM_BINS + 1)
+        genuine = np.histogram([0.0, 0.1], bins=edges)[0]
+        impostor = np.histogram([0.0, 0.0, 0.9], bins=edges)[0]
+        far, frr = error_rates(genuine, impostor)
+        self.assertFalse(threshold_for_far(far, frr, edges, 0.1)["attainable"])
+        self.assertTrue(threshold_for_far(far, frr, edges, 0.7)["attainable"])
+        with self.assertRaises(UnattainableFarError):
+            build_calibration(genuine, impostor, edges, [0.01], 0.1, 50)
+
+    def test_uncalibrated_engine_threshold_maps_to_served_threshold(self):
+        result = {"distance": 0.3, "threshold": 0.18, "model": "face_recognition", "threshold_anchored": True}
+        self.assertEqual(calculate_confidence(result, 50, calibration={}), (47, 50, False, "Image does not match"))
+        result["distance"] = 0.18
+        self.assertEqual(calculate_confidence(result, 50, calibration={}), (50, 50, True, "Images Match"))
+        result["distance"] = 0.09
+        self.assertEqual(calculate_confidence(result, 50, calibration={})[0], 75)
+        # Rounds to 50 but lies beyond the engine's threshold
+        result["distance"] = 0.181
+        self.assertEqual(calculate_confidence(result, 50, calibration={}), (50, 50, False, "Image does not match"))
+
+        result.update(distance=0.0, threshold=0.0)
+        self.assertEqual(calculate_confidence(result, 50, calibration={})[2], True)
+        result["distance"] = 0.1
+        self.assertEqual(calculate_confidence(result, 50, calibration={})[2], False)
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    """Serve ``size`` bytes for /<size>.jpg, without a Content-Length for /<size>.jpg?stream."""
+
+    def do_GET(self):
+        size = int(self.path.split("/")[-1].split(".")[0])
+        self.send_response(200)
+        if not self.path.endswith("?stream"):
+            self.send_header("Content-Length", str(size))
+        self.end_headers()
+        try:
+            for _ in range(0, size, 4096):
+                self.wfile.write(b"x" * min(4096, size))
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchImageTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def test_size_limit(self):
+        self.assertEqual(len(fetch_image(f"{self.base_url}/4096.jpg", max_bytes=4096)), 4096)
+        self.assertEqual(len(fetch_image(f"{self.base_url}/4096.jpg?stream", max_bytes=4096)), 4096)
+        with self.assertRaises(ImageTooLargeError):
+            fetch_image(f"{self.base_url}/8192.jpg", max_bytes=4096)
+        with self.assertRaises(ImageTooLargeError):
+            fetch_image(f"{self.base_url}/4194304.jpg?stream", max_bytes=4096)
+
+
+class DeadlineTests(SimpleTestCase):
+    def test_shared_download_outlives_a_shorter_deadline(self):
+        fetches = []
+
+        def slow_fetch(image_url, deadline=None, max_bytes=None):
+            fetches.append(deadline)
+            for _ in range(20):
+                time.sleep(0.02)
+                check_deadline(deadline, "download")
+            return b"image"
+
+        def download(seconds, outcome):
+            serializer = FaceComparisonSerializer(context={"deadline": Deadline(seconds)})
+            try:
+                outcome.append(serializer.download_image_to_temp_file(IMAGE1))
+            except Exception as e:
+                outcome.append(e)
+
+        short, long = [], []
+        with mock.patch("face_rec.serializers.fetch_image", side_effect=slow_fetch):
+            leader = threading.Thread(target=download, args=(0.1, short))
+            leader.start()
+            time.sleep(0.03)
+            download(5, long)
+            leader.join()
+
+        self.assertIsInstance(short[0], DeadlineExceeded)
+        with open(long[0], "rb") as file:
+            self.assertEqual(file.read(), b"image")
+        os.remove(long[0])
+        self.assertEqual(len(fetches), 2)
+
+    def test_deadline_spent_waiting_for_admission_is_a_timeout(self):
+        admission = AdmissionController(1, 1, 10, name="test_admission")
+        admission.acquire()
+        request = APIRequestFactory().post(
+            "/api/compare", {"image1": IMAGE1, "image2": IMAGE2}, format="json", HTTP_X_REQUEST_DEADLINE="0.1"
+        )
+        with mock.patch("face_rec.views.compare_admission", admission):
+            response = FaceComparisonView.as_view()(request)
+
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(response.data["error"]["timeout"]["stage"], "admission")
+
+
+def stub_mtcnn(face_fractions):
+    """An ``mtcnn`` module whose detector finds square faces of the given fractions of the image side."""
+
+    class MTCNN:
+        def detect_faces(self, image):
+            side = image.shape[0]
+            return [
+                {"box": [index * side // 4, 0, int(side * fraction), int(side * fraction)], "confidence": 0.99}
+                for index, fraction in enumerate(face_fractions)
+            ]
+
+    return types.SimpleNamespace(MTCNN=MTCNN)
+
+
+class FaceImageMixin:
+    def setUp(self):
+        # A sharp, evenly lit 60x60 image, so only the face size can fail
+        image = np.indices((60, 60)).sum(axis=0) % 2 * 120 + 60
+        self.image_path = tempfile.NamedTemporaryFile(delete=False, suffix=".png").name
+        cv2.imwrite(self.image_path, np.dstack([image] * 3).astype(np.uint8))
+
+    def tearDown(self):
+        os.remove(self.image_path)
+
+
+class QualityGateTests(FaceImageMixin, SimpleTestCase):
+    def test_small_faces_are_rejected_not_replaced_by_the_whole_image(self):
+        with mock.patch.dict(sys.modules, {"mtcnn": stub_mtcnn([0.5, 0.4])}), \
+                mock.patch("face_rec.utils.quality.QUALITY_GATE", True):
+            with self.assertRaises(ImageQualityError) as raised:
+                detect_face_crops(self.image_path, min_size=40)
+        self.assertEqual(raised.exception.check, "face_size")
+
+    def test_whole_image_fallback_without_the_gate(self):
+        with mock.patch.dict(sys.modules, {"mtcnn": stub_mtcnn([0.5])}), \
+                mock.patch("face_rec.utils.quality.QUALITY_GATE", False):
+            faces, _ = detect_face_crops(self.image_path, min_size=40)
+        self.assertEqual([box for _, box in faces], [[0, 0, 60, 60]])
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.headers = {"HTTP_X_API_KEY": next(iter(load_api_keys()))}
+        limiter = mock.Mock()
+        limiter.acquire.return_value = Decision(False, "rate", 3)
+        patcher = mock.patch("core.api_middleware.rate_limiter", limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_comparison_requests_are_limited(self):
+        self.assertEqual(self.client.post("/api/compare", {}, **self.headers).status_code, 429)
+        self.assertEqual(self.client.post("/api/jobs", {}, **self.headers).status_code, 429)
+        job = enqueue_job([{"image1": IMAGE1, "image2": IMAGE2}])
+        self.assertEqual(self.client.get(f"/api/jobs/{job.id}", **self.headers).status_code, 200)
+
+    def test_metrics_need_the_admin_key(self):
+        self.assertEqual(self.client.get("/api/metrics", **self.headers).status_code, 403)
+
+
+def stub_face_recognition(face_fractions):
+    """A ``face_recognition`` module finding square faces of the given fractions of the image side."""
+
+    def face_locations(image, model="hog"):
+        side = image.shape[0]
+        return [
+            (0, index * side // 4 + int(side * fraction), int(side * fraction), index * side // 4)
+            for index, fraction in enumerate(face_fractions)
+        ]
+
+    return types.SimpleNamespace(face_locations=face_locations)
+
+
+class EngineTests(FaceImageMixin, SimpleTestCase):
+    def test_face_recognition_applies_the_multi_face_limits(self):
+        engine = FaceRecognitionEngine(min_size=20, max_faces=1)
+        with mock.patch.dict(sys.modules, {"face_recognition": stub_face_recognition([0.5, 0.4])}), \
+                mock.patch("face_rec.utils.quality.QUALITY_GATE", False):
+            faces, _ = engine.detect(self.image_path)
+            self.assertEqual([box for _, box in faces], [[0, 0, 30, 30]])
+
+            engine.min_size = 40
+            faces, _ = engine.detect(self.image_path)
+            self.assertEqual([box for _, box in faces], [[0, 0, 60, 60]])
+
+        with mock.patch.dict(sys.modules, {"face_recognition": stub_face_recognition([0.5])}), \
+                mock.patch("face_rec.utils.quality.QUALITY_GATE", True):
+            with self.assertRaises(ImageQualityError):
+                engine.detect(self.image_path)
+
+    def test_deepface_multi_face_uses_the_shared_closest_pair(self):
+        engine = DeepFaceEngine("Facenet512", model=object())
+        faces = ([("a", [0, 0, 1, 1]), ("b", [5, 5, 1, 1])], None)
+        embeddings = np.array([[1.0, 0.0], [0.0, 1.0], [0.6, 0.8], [0.0, 1.0]])
+        with mock.patch.object(DeepFaceEngine, "threshold", 0.4), \
+                mock.patch.object(engine, "detect", return_value=faces), \
+                mock.patch.object(engine, "embed", return_value=embeddings):
+            result, _ = engine.compare(self.image_path, self.image_path, multi_face=True)
+
+        self.assertAlmostEqual(result["distance"], 0.0)
+        self.assertEqual(result["best_pair"]["image1"]["index"], 1)
+        self.assertFalse(result["threshold_anchored"])
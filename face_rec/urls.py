@@ -2,5 +2,10 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    path("compare",views.FaceComparisonView.as_view())
+    path("compare",views.FaceComparisonView.as_view(), name="compare"),
+    path("jobs",views.ComparisonJobView.as_view(), name="jobs"),
+    path("jobs/<uuid:job_id>",views.ComparisonJobDetailView.as_view()),
+    path("metrics",views.MetricsView.as_view()),
+    path("health",views.HealthView.as_view(), name="health"),
+    path("admin/model",views.ModelConfigView.as_view()),
 ]
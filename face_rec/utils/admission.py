@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+from . import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Comparisons allowed to run at the same time in one worker process
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 1))
+# Requests allowed to wait for a free slot; anything beyond is shed immediately
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 2))
+# Seconds a queued request waits for a slot before it is shed
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", 10))
+# Retry-After sent with shed requests
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 5))
+
+
+class AdmissionController:
+    """
+    Bound the number of in-flight and waiting comparisons of a worker.
+
+    The wait queue only fills up when the worker serves requests from several
+    threads, which gunicorn_config.py sets up with gthread workers; with sync
+    workers every request is admitted or finds the single slot taken and is shed.
+    """
+
+    def __init__(self, max_in_flight, max_queue, queue_timeout, name="admission"):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self.in_flight = 0
+        self.waiting = 0
+        self._condition = threading.Condition()
+        metrics.register_collector(self.collect_metrics)
+
+    def acquire(self, timeout=None):
+        """
+        Take a slot. Returns ``(admitted, reason)``; ``reason`` explains why a request was shed.
+
+        A queued request waits at most ``queue_timeout`` seconds, or ``timeout`` when shorter.
+        """
+        with self._condition:
+            if self.in_flight < self.max_in_flight and self.waiting == 0:
+                self.in_flight += 1
+                metrics.increment(f"{self.name}.admitted")
+                return True, None
+
+            if self.waiting >= self.max_queue:
+                metrics.increment(f"{self.name}.shed.queue_full")
+                return False, "Server is busy: comparison queue is full, please retry later."
+
+            self.waiting += 1
+            started = time.monotonic()
+            try:
+                wait = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+                admitted = self._condition.wait_for(lambda: self.in_flight < self.max_in_flight, wait)
+            finally:
+                self.waiting -= 1
+            metrics.increment(f"{self.name}.queue_wait_seconds", time.monotonic() - started)
+
+            if not admitted:
+                metrics.increment(f"{self.name}.shed.queue_timeout")
+                return False, "Server is busy: timed out waiting for a free comparison slot, please retry later."
+
+            self.in_flight += 1
+            metrics.increment(f"{self.name}.admitted")
+            return True, None
+
+    def release(self):
+        """Give back a slot taken with ``acquire``."""
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def collect_metrics(self):
+        return {
+            f"{self.name}.in_flight": self.in_flight,
+            f"{self.name}.queue_depth": self.waiting,
+            f"{self.name}.max_in_flight": self.max_in_flight,
+            f"{self.name}.max_queue": self.max_queue,
+        }
+
+
+compare_admission = AdmissionController(
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_QUEUE,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    name="admission.compare",
+)
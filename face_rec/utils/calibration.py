@@ -0,0 +1,197 @@
+import os
+import json
+from bisect import bisect_right
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+CALIBRATION_FILE = os.getenv("CALIBRATION_FILE", str(BASE_DIR / "calibration.json"))
+
+# Cosine distances lie in [0, 2]; the histograms use this many bins over that range
+HISTOGRAM_BINS = 4000
+HISTOGRAM_RANGE = (0.0, 2.0)
+# Number of knots stored in the distance -> confidence table
+CONFIDENCE_TABLE_KNOTS = 201
+
+
+def load_calibration_tables(path=CALIBRATION_FILE):
+    """Load the per-model calibration tables written by ``manage.py calibrate_thresholds``."""
+    try:
+        with open(path) as file:
+            tables = json.load(file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable calibration file {path}: {e}")
+        return {}
+    return tables
+
+
+def calibrated_confidence(table, distance):
+    """Map a distance to a confidence level with the table's piecewise-linear mapping."""
+    distances = table["confidence_table"]["distance"]
+    confidences = table["confidence_table"]["confidence"]
+    if distance <= distances[0]:
+        return confidences[0]
+    if distance >= distances[-1]:
+        return confidences[-1]
+    right = bisect_right(distances, distance)
+    left = right - 1
+    span = distances[right] - distances[left]
+    weight = (distance - distances[left]) / span if span else 0.0
+    return confidences[left] + weight * (confidences[right] - confidences[left])
+
+
+def threshold_anchored_confidence(distance, threshold, threshold_confidence, max_distance=HISTOGRAM_RANGE[1]):
+    """
+    Map a distance linearly so that ``threshold`` maps exactly to ``threshold_confidence``.
+
+    For models without a calibration table whose own threshold is far from
+    the linear ``(1 - distance) * 100`` scale: distances up to ``threshold``
+    span 100 down to ``threshold_confidence``, and the rest down to 0 at
+    ``max_distance``.
+    """
+    if distance <= threshold:
+        # A zero threshold (tolerance 0) only accepts identical embeddings
+        closeness = 1 - distance / threshold if threshold > 0 else 1.0
+        return threshold_confidence + (100 - threshold_confidence) * closeness
+    return threshold_confidence * max(1 - (distance - threshold) / max(max_distance - threshold, 1e-12), 0.0)
+
+
+def normalize_embeddings(embeddings):
+    """L2-normalize embeddings so cosine distance becomes ``1 - dot product``."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def pair_distance_histograms(embeddings, labels, block_size=1024):
+    """
+    Histogram the cosine distances of every genuine and impostor pair.
+
+    Distances are computed block by block with one matrix product per block, and
+    only the upper triangle is kept so every unordered pair is counted once.
+    Memory stays bounded by ``block_size * len(embeddings)``.
+    """
+    normalized = normalize_embeddings(embeddings)
+    labels = np.asarray(labels)
+    edges = np.linspace(*HISTOGRAM_RANGE, HISTOGRAM_BINS + 1)
+    genuine = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    impostor = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+
+    count = len(normalized)
+    for start in range(0, count, block_size):
+        stop = min(start + block_size, count)
+        distances = 1.0 - normalized[start:stop] @ normalized[start:].T
+        np.clip(distances, *HISTOGRAM_RANGE, out=distances)
+
+        rows = np.arange(start, stop)[:, None]
+        columns = np.arange(start, count)[None, :]
+        upper = columns > rows
+        same = labels[start:stop, None] == labels[None, start:]
+
+        genuine += np.histogram(distances[upper & same], bins=edges)[0]
+        impostor += np.histogram(distances[upper & ~same], bins=edges)[0]
+
+    return genuine, impostor, edges
+
+
+def error_rates(genuine, impostor):
+    """FAR and FRR when accepting every distance below the right edge of each bin."""
+    far = np.cumsum(impostor) / max(impostor.sum(), 1)
+    frr = 1.0 - np.cumsum(genuine) / max(genuine.sum(), 1)
+    return far, frr
+
+
+class UnattainableFarError(ValueError):
+    """No distance threshold keeps the false accept rate at or below the requested one."""
+
+
+def threshold_for_far(far, frr, edges, target_far):
+    """
+    Largest distance threshold whose FAR does not exceed ``target_far``.
+
+    When even the smallest bin accepts too many impostors the target is
+    reported with ``attainable`` False and no distance.
+    """
+    allowed = np.nonzero(far <= target_far)[0]
+    if not len(allowed):
+        return {"far": float(far[0]), "frr": float(frr[0]), "distance": None, "target_far": target_far, "attainable": False}
+    index = allowed[-1]
+    return {
+        "far": float(far[index]),
+        "frr": float(frr[index]),
+        "distance": float(edges[index + 1]),
+        "target_far": target_far,
+        "attainable": True,
+    }
+
+
+def confidence_table(genuine, impostor, edges, threshold, threshold_confidence):
+    """
+    Build a monotonic distance -> confidence mapping anchored at the operating threshold.
+
+    Below the threshold the confidence rises from ``threshold_confidence`` to 100
+    following the genuine distance distribution; above it the confidence falls to
+    0 following the impostor distribution. A distance at the threshold maps exactly
+    to ``threshold_confidence``, so ``confidence >= threshold_confidence`` keeps
+    the calibrated FAR/FRR.
+    """
+    genuine_cdf = np.concatenate([[0.0], np.cumsum(genuine) / max(genuine.sum(), 1)])
+    impostor_cdf = np.concatenate([[0.0], np.cumsum(impostor) / max(impostor.sum(), 1)])
+
+    knots = np.unique(np.concatenate([np.linspace(edges[0], edges[-1], CONFIDENCE_TABLE_KNOTS), [threshold]]))
+    genuine_at = np.interp(knots, edges, genuine_cdf)
+    impostor_at = np.interp(knots, edges, impostor_cdf)
+    genuine_at_threshold = np.interp(threshold, edges, genuine_cdf)
+    impostor_at_threshold = np.interp(threshold, edges, impostor_cdf)
+
+    confidence = np.empty_like(knots)
+    below = knots <= threshold
+    if genuine_at_threshold > 0:
+        closeness = 1.0 - genuine_at[below] / genuine_at_threshold
+    else:
+        closeness = 1.0 - knots[below] / threshold if threshold > 0 else np.ones(below.sum())
+    confidence[below] = threshold_confidence + (100 - threshold_confidence) * closeness
+
+    if impostor_at_threshold < 1:
+        remoteness = (impostor_at[~below] - impostor_at_threshold) / (1.0 - impostor_at_threshold)
+    else:
+        remoteness = np.ones((~below).sum())
+    confidence[~below] = threshold_confidence * (1.0 - remoteness)
+
+    # Guard against rounding noise so the table stays monotonic
+    confidence = np.minimum.accumulate(np.clip(confidence, 0, 100))
+    return {"distance": knots.round(6).tolist(), "confidence": confidence.round(4).tolist()}
+
+
+def build_calibration(genuine, impostor, edges, target_fars, operating_far, threshold_confidence):
+    """
+    Summarize the distance histograms of one model into its calibration table.
+
+    Raises UnattainableFarError when no threshold meets ``operating_far``.
+    """
+    far, frr = error_rates(genuine, impostor)
+    eer_index = int(np.argmin(np.abs(far - frr)))
+    operating_point = threshold_for_far(far, frr, edges, operating_far)
+    if not operating_point["attainable"]:
+        raise UnattainableFarError(
+            f"No threshold reaches a FAR of {operating_far}; the lowest is {operating_point['far']:.6g}."
+        )
+    return {
+        "distance_metric": "cosine",
+        "pairs": {"genuine": int(genuine.sum()), "impostor": int(impostor.sum())},
+        "threshold_confidence": threshold_confidence,
+        "operating_point": operating_point,
+        "thresholds": [threshold_for_far(far, frr, edges, target) for target in target_fars],
+        "eer": {"rate": float((far[eer_index] + frr[eer_index]) / 2), "distance": float(edges[eer_index + 1])},
+        "confidence_table": confidence_table(
+            genuine, impostor, edges, operating_point["distance"], threshold_confidence
+        ),
+    }
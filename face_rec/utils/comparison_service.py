@@ -0,0 +1,234 @@
+import os
+import hashlib
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from ..serializers import FaceComparisonSerializer
+from .calibration import calibrated_confidence, load_calibration_tables, threshold_anchored_confidence
+from .deadline import DeadlineExceeded
+from .deepface_service import model_name
+from .engines import FACE_ENGINE, get_engine
+from .model_registry import FIXED_THRESHOLD, model_registry
+
+load_dotenv()
+
+# Per-model tables from `manage.py calibrate_thresholds`, loaded once per worker
+CALIBRATION_TABLES = load_calibration_tables()
+# Answer with hashes of image1/image2 instead of echoing them, unless a request sets "compact"
+COMPACT_RESPONSES = os.getenv("COMPACT_RESPONSES", "false").lower() in ("1", "true", "yes")
+
+
+def format_validation_errors(detail):
+    """Flatten a DRF validation error dict into a single readable reason string."""
+    errors = {}
+    for field, messages in detail.items():
+        if isinstance(messages, list):  # Handle list of error messages
+            # Extract only the message string, ignoring 'ErrorDetail' structure
+            errors[field] = " ".join(
+                str(message).split("string='")[1].split("',")[0] if "string='" in str(message) else str(message)
+                for message in messages
+            )
+        else:
+            # Handle non-list error messages
+            errors[field] = str(messages)
+
+    # Combine all error messages into a single string
+    return " | ".join(f"{field}: {msg}" for field, msg in errors.items())
+
+
+def image_reference(value):
+    """Short stand-in for an image input: the SHA-256 of the URL or Base64 string exactly as sent."""
+    if value is None:
+        return None
+    return "sha256:" + hashlib.sha256(str(value).encode()).hexdigest()
+
+
+def compact_requested(data):
+    """Whether a request asked for compact responses, falling back to COMPACT_RESPONSES."""
+    value = data.get("compact") if hasattr(data, "get") else None
+    if value is None or value == "":
+        return COMPACT_RESPONSES
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def build_payload(status_flag, reason, confidence_level, threshold, match, image1, image2, compact=None):
+    """
+    Build the response payload shared by every face comparison response.
+
+    In compact mode (``compact``, or COMPACT_RESPONSES when it is None) the
+    images are replaced by ``image_reference`` hashes; the keys stay the same.
+    """
+    if compact is None:
+        compact = COMPACT_RESPONSES
+    if compact:
+        image1, image2 = image_reference(image1), image_reference(image2)
+    return {
+        "status": status_flag,
+        "reason": reason,
+        "confidenceLevel": confidence_level,
+        "threshold": threshold,
+        "match": match,
+        "image1": image1,
+        "image2": image2,
+    }
+
+
+def build_timeout_payload(error, deadline, threshold, image1, image2, compact=None):
+    """Comparison payload for a request whose deadline ran out, naming the stage it reached."""
+    payload = build_payload(
+        False,
+        f"Request deadline of {deadline.seconds:g} seconds exceeded during {error.stage}.",
+        None,
+        threshold,
+        False,
+        image1,
+        image2,
+        compact,
+    )
+    payload["timeout"] = {
+        "stage": error.stage,
+        "budgetSeconds": deadline.seconds,
+        "elapsedSeconds": round(deadline.elapsed(), 3),
+    }
+    return payload
+
+
+def cleanup_temp_files(paths):
+    """Remove temporary files, ignoring the ones that are already gone."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+
+
+def calculate_confidence(result, fixed_threshold=80, calibration=None):
+    """
+    Turn a DeepFace verification result into a confidence level and match decision.
+
+    When the model has a calibration table, the distance is mapped with it.
+    Results marked ``threshold_anchored`` (engines other than DeepFace) are
+    mapped so the engine's own threshold lands on ``fixed_threshold``;
+    otherwise the confidence is the linear ``(1 - distance) * 100``. Either way
+    the match decision is the unrounded ``confidence >= fixed_threshold``, so the threshold an
+    admin serves applies to calibrated models too. A table maps its operating
+    point to its ``threshold_confidence``, which is FIXED_THRESHOLD by default.
+    """
+    print(result)
+    # Extract the original distance
+    distance = result.get('distance', 0.0)
+    if calibration is None:
+        calibration = CALIBRATION_TABLES.get(result.get('model', model_name))
+    if calibration:
+        confidence_level = calibrated_confidence(calibration, distance)
+    elif result.get('threshold_anchored'):
+        confidence_level = threshold_anchored_confidence(distance, result['threshold'], fixed_threshold)
+    else:
+        confidence_level = (1 - distance) * 100
+    print(confidence_level)
+
+    # Decide on the exact value: rounding first would accept everything up to half a point below
+    # the threshold, which above a calibrated threshold is a slice of the impostor distribution
+    confidence_level = max(min(confidence_level, 100), 0)
+    verified = confidence_level >= fixed_threshold
+    # Only the reported level is rounded
+    confidence_level = round(confidence_level)
+    reason = "Images Match" if verified else "Image does not match"
+
+    return confidence_level, fixed_threshold, verified, reason
+
+
+@contextmanager
+def acquire_engine(name=None):
+    """
+    Yield the engine called ``name`` (FACE_ENGINE by default) and the threshold it is served with.
+
+    The DeepFace engine pins the active model of the registry for the duration.
+    """
+    name = name or FACE_ENGINE
+    if name == "deepface":
+        with model_registry.acquire() as handle:
+            yield get_engine(name, handle.model_name, handle.model), handle.fixed_threshold
+    else:
+        yield get_engine(name), model_registry.active_config["fixed_threshold"]
+
+
+def compare_validated_images(validated_data, fixed_threshold=None, deadline=None):
+    """
+    Compare the images of a validated FaceComparisonSerializer.
+
+    Returns the payload and the HTTP status code that describes it. Temporary
+    files created while downloading, decoding and aligning are removed. The
+    comparison runs on the requested engine (for DeepFace, the model that is
+    active when it starts) with the served threshold unless
+    ``fixed_threshold`` is given. When ``deadline``
+    runs out the remaining stages are skipped and a 504 payload is returned.
+    """
+    image1_path = validated_data["image1_temp_path"]
+    image2_path = validated_data["image2_temp_path"]
+    image1 = validated_data["image1"]
+    image2 = validated_data["image2"]
+    compact = validated_data.get("compact")
+
+    with acquire_engine(validated_data.get("engine")) as (engine, engine_threshold):
+        if fixed_threshold is None:
+            fixed_threshold = engine_threshold
+        try:
+            result, error_message_or_path = engine.compare(
+                image1_path, image2_path, multi_face=validated_data.get("multi_face", False), deadline=deadline
+            )
+        except DeadlineExceeded as e:
+            cleanup_temp_files([image1_path, image2_path])
+            return build_timeout_payload(e, deadline, fixed_threshold, image1, image2, compact), 504
+
+    # clean up process
+    temp_image_path = [image1_path, image2_path]
+    if isinstance(error_message_or_path, list):
+        temp_image_path = temp_image_path + error_message_or_path
+    cleanup_temp_files(temp_image_path)
+
+    if result:
+        confidence_level, threshold, verified, reason = calculate_confidence(result, fixed_threshold)
+        payload = build_payload(True, reason, confidence_level, threshold, verified, image1, image2, compact)
+        if "best_pair" in result:
+            payload["faces"] = result["best_pair"]
+        return payload, 200
+
+    return build_payload(False, error_message_or_path, None, fixed_threshold, False, image1, image2, compact), 400
+
+
+def compare_image_inputs(
+    image1,
+    image2,
+    fixed_threshold=None,
+    multi_face=False,
+    engine=None,
+    compact=None,
+    raise_transient_errors=False,
+    deadline=None,
+):
+    """
+    Validate, fetch and compare two raw image inputs (URLs or Base64 strings).
+
+    With ``raise_transient_errors`` a download that failed for a reason worth
+    retrying raises ``TransientDownloadError`` instead of returning a 400.
+    When ``deadline`` runs out, downloads included, a 504 payload is returned.
+    """
+    serializer = FaceComparisonSerializer(
+        data={"image1": image1, "image2": image2, "multi_face": multi_face, "engine": engine, "compact": compact},
+        context={"raise_transient_errors": raise_transient_errors, "deadline": deadline},
+    )
+    try:
+        valid = serializer.is_valid()
+    except DeadlineExceeded as e:
+        if fixed_threshold is None:
+            fixed_threshold = model_registry.active_config["fixed_threshold"]
+        return build_timeout_payload(e, deadline, fixed_threshold, image1, image2, compact), 504
+    if not valid:
+        if fixed_threshold is None:
+            fixed_threshold = model_registry.active_config["fixed_threshold"]
+        reason = format_validation_errors(serializer.errors)
+        return build_payload(False, reason, None, fixed_threshold, False, image1, image2, compact), 400
+    return compare_validated_images(serializer.validated_data, fixed_threshold, deadline)
@@ -0,0 +1,81 @@
+import os
+import time
+
+from dotenv import load_dotenv
+
+from . import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Budget of a compare request from arrival to response, in seconds (0 disables deadlines)
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", 60))
+# Largest budget a client may ask for with the X-Request-Deadline header
+REQUEST_DEADLINE_MAX_SECONDS = float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", 120))
+DEADLINE_HEADER = "X-Request-Deadline"
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time; ``stage`` is the stage that was about to run or was running."""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Time budget of one request, checked between the stages of a comparison.
+
+    Cancellation is cooperative: a stage that already started (a detector
+    or model call) runs to completion, and the next ``check`` abandons the
+    rest of the work. ``seconds=None`` means no deadline.
+    """
+
+    def __init__(self, seconds=None):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.expires_at = self.started + seconds if seconds else None
+
+    @classmethod
+    def from_request(cls, request):
+        """Budget from the X-Request-Deadline header (seconds), capped, or REQUEST_DEADLINE_SECONDS."""
+        seconds = REQUEST_DEADLINE_SECONDS
+        try:
+            requested = float(request.headers.get(DEADLINE_HEADER, ""))
+        except ValueError:
+            requested = None
+        if requested is not None and requested > 0:
+            seconds = min(requested, REQUEST_DEADLINE_MAX_SECONDS)
+        return cls(seconds or None)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        """Seconds left, or None without a deadline."""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage):
+        """Raise DeadlineExceeded when the budget is spent, before ``stage`` starts."""
+        if self.expired():
+            metrics.increment(f"deadline.exceeded.{stage}")
+            raise DeadlineExceeded(stage)
+
+    def timeout(self, default=None):
+        """Timeout for a blocking call: the time left, bounded by ``default``."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return remaining if default is None else min(remaining, default)
+
+
+def check_deadline(deadline, stage):
+    """``deadline.check(stage)`` for call sites where the deadline is optional."""
+    if deadline is not None:
+        deadline.check(stage)
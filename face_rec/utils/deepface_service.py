@@ -3,18 +3,27 @@ import os
 os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 import cv2
 import requests
+import hashlib
 import tempfile
 import numpy as np
 import time
 from multiprocessing import Process, Queue
-from deepface import DeepFace
-from retinaface import RetinaFace
 from dotenv import load_dotenv
-from mtcnn import MTCNN
+from .deadline import DeadlineExceeded, check_deadline
+from .image_io import crop_full_resolution, decode_for_detection
+from .quality import ImageQualityError, check_face_detected, check_face_quality, select_faces
+from .singleflight import SingleFlight
 
 # Load environment variables
 load_dotenv()
 
+# Crop aligned faces from the full-resolution image instead of the reduced detection image
+FULL_RESOLUTION_CROP = os.getenv("FULL_RESOLUTION_CROP", "false").lower() in ("1", "true", "yes")
+# Multi-face comparisons ignore faces smaller than this (in original image pixels)
+MULTI_FACE_MIN_SIZE = int(os.getenv("MULTI_FACE_MIN_SIZE", 40))
+# ...and keep at most this many of the most confident faces per image
+MULTI_FACE_MAX_FACES = int(os.getenv("MULTI_FACE_MAX_FACES", 10))
+
 MODELS = [
     "VGG-Face", 
     "Facenet", 
@@ -28,11 +37,47 @@ MODELS = [
     "GhostFaceNet"
 ]
 
-# Load the DeepFace model once
+# Model used until an admin switches to another one (see model_registry.py)
 model_name = os.getenv("DEEPFACE_MODEL", "Facenet512")
 if model_name not in MODELS:
     raise ValueError(f"Invalid model specified: {model_name}. Must be one of {MODELS}.")
-deepface_model = DeepFace.build_model(model_name)
+
+image_representations = SingleFlight("representation")
+
+
+def load_model(name):
+    """Build a DeepFace model and run one embedding so the first comparison does not pay for warm-up."""
+    from deepface import DeepFace
+
+    if name not in MODELS:
+        raise ValueError(f"Invalid model specified: {name}. Must be one of {MODELS}.")
+    model = DeepFace.build_model(name)
+    DeepFace.represent(img_path=np.zeros((224, 224, 3), dtype=np.uint8), model_name=name, enforce_detection=False)
+    return model
+
+
+def unload_model(name):
+    """Drop a model from DeepFace's model cache so its memory can be reclaimed."""
+    from deepface.modules import modeling
+
+    cache = getattr(modeling, "cached_models", {})
+    for models in cache.values():
+        if isinstance(models, dict):
+            models.pop(name, None)
+
+
+def import_inference_libraries():
+    """
+    Import TensorFlow, DeepFace and the face detectors.
+
+    They are imported on first use so that entry points without inference
+    (migrations, collectstatic, the API docs, health checks) start quickly;
+    serving processes call this up front through ``model_registry.preload``.
+    """
+    from deepface import DeepFace  # noqa: F401  (imports TensorFlow)
+    from retinaface import RetinaFace  # noqa: F401
+    from mtcnn import MTCNN  # noqa: F401
+
 
 def download_image_to_temp_file(image_url):
     """Download the image from a URL and save it to a temporary file."""
@@ -57,19 +102,17 @@ def download_image_to_temp_file(image_url):
 
 def align_face_with_retinaface(image_path, to_grayscale=True,downscale_factor=0.5):
     """Align the face in the image using RetinaFace and optionally convert to grayscale."""
+    from retinaface import RetinaFace
+
     try:
         total_start_time = time.time()  # Start the total timer
         
-        # Step 1: Load the image and optionally downscale it
+        # Step 1: Decode the image directly at the downscaled detection size
         start_time = time.time()
-        image = cv2.imread(image_path)
+        image, _ = decode_for_detection(image_path, downscale_factor)
         if image is None:
             return None, "Image not found or could not be opened."
 
-
-        original_size = image.shape[:2]  # (height, width)
-        if downscale_factor < 1.0:
-            image = cv2.resize(image, (int(original_size[1] * downscale_factor), int(original_size[0] * downscale_factor)))
         loading_and_resizing_time = time.time() - start_time
         print(f"Time taken for loading and resizing: {loading_and_resizing_time:.4f} seconds")
 
@@ -109,37 +152,45 @@ def align_face_with_retinaface(image_path, to_grayscale=True,downscale_factor=0.
         return None, str(e)
     
     
-def align_face_with_mtcnn(image_path, to_grayscale=True, downscale_factor=0.5):
+def align_face_with_mtcnn(image_path, to_grayscale=True, downscale_factor=0.5, full_resolution_crop=FULL_RESOLUTION_CROP, deadline=None):
     """Align the face in the image using MTCNN, optionally convert to grayscale, and save to a file."""
+    from mtcnn import MTCNN
+
     try:
         total_start_time = time.time()  # Start the total timer
 
-        # Step 1: Load the image and optionally downscale it
+        # Step 1: Decode the image directly at the downscaled detection size
         start_time = time.time()
-        image = cv2.imread(image_path)
+        check_deadline(deadline, "decode")
+        image, scale = decode_for_detection(image_path, downscale_factor)
         if image is None:
             return None, "Image not found or could not be opened."
 
-        original_size = image.shape[:2]  # (height, width)
-        if downscale_factor < 1.0:
-            image = cv2.resize(image, (int(original_size[1] * downscale_factor), int(original_size[0] * downscale_factor)))
         loading_and_resizing_time = time.time() - start_time
         # print(f"Time taken for loading and resizing: {loading_and_resizing_time:.4f} seconds")
 
         # Step 2: Face detection with MTCNN
         start_time = time.time()
+        check_deadline(deadline, "detection")
         detector = MTCNN()
         faces = detector.detect_faces(image)
         face_detection_time = time.time() - start_time
         # print(f"Time taken for face detection: {face_detection_time:.4f} seconds")
 
+        # With the quality gate on, a missing or poor face is rejected instead of falling back
+        check_face_detected(faces)
         if len(faces) == 0:
             return None, "No faces detected."
 
         # Get the bounding box of the first detected face
         x, y, width, height = faces[0]['box']
         x, y = max(0, x), max(0, y)
-        face_image = image[y:y + height, x:x + width]
+        check_face_quality(image, [x, y, width, height], scale)
+        if full_resolution_crop and scale < 1.0:
+            # Go back to the original pixels for the crop; detection ran on the reduced decode
+            face_image = crop_full_resolution(image_path, (x, y, width, height), scale)
+        else:
+            face_image = image[y:y + height, x:x + width]
 
         # Step 3: Grayscale conversion (if required)
         start_time = time.time()
@@ -163,6 +214,8 @@ def align_face_with_mtcnn(image_path, to_grayscale=True, downscale_factor=0.5):
         # Return the file path of the saved image
         return temp_file.name, None
 
+    except (ImageQualityError, DeadlineExceeded):
+        raise
     except Exception as e:
         return None, str(e)
 
@@ -178,40 +231,169 @@ def align_face_with_mtcnn(image_path, to_grayscale=True, downscale_factor=0.5):
 
 #     result_queue.put((True, aligned_image_path))
 
-def process_image(image_path, target_size=(224, 224), to_grayscale=True):
+def process_image(image_path, target_size=(224, 224), to_grayscale=True, deadline=None):
     """Process the image: align the face and check detection."""
     print(f"Processing image: {image_path}")
-    aligned_image_path, error = align_face_with_mtcnn(image_path, to_grayscale)
+    aligned_image_path, error = align_face_with_mtcnn(image_path, to_grayscale, deadline=deadline)
     if aligned_image_path is None:
         return False, f"Alignment failed: {error}"
     return True, aligned_image_path
 
 
 
-def compare_faces(image1_path, image2_path):
-    """Compare two faces using DeepFace without multiprocessing."""
-    # Process the first image
-    result1, aligned_image1_path = process_image(image1_path)
-    if not result1:
-        aligned_image1_path = image1_path  # Use original if alignment fails
+def content_key(image_path):
+    """SHA-256 of an image file, so the same picture is recognised whatever URL or payload it came from."""
+    with open(image_path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
 
-    # Process the second image
-    result2, aligned_image2_path = process_image(image2_path)
-    if not result2:
-        aligned_image2_path = image2_path  # Use original if alignment fails
+
+def represent_image(image_path, model_name=model_name, deadline=None):
+    """Align the face of an image and embed it, the way DeepFace.verify embeds each image."""
+    from deepface import DeepFace
+
+    result, aligned_image_path = process_image(image_path, deadline=deadline)
+    if not result:
+        aligned_image_path = image_path  # Use original if alignment fails
 
     try:
-        # Compare the aligned faces using the loaded DeepFace model
-        result = DeepFace.verify(
-            img1_path=aligned_image1_path,
-            img2_path=aligned_image2_path,
+        check_deadline(deadline, "embedding")
+        representations = DeepFace.represent(
+            img_path=aligned_image_path,
             model_name=model_name,
             enforce_detection=False
         )
-        return result, [aligned_image1_path, aligned_image2_path]
+    finally:
+        if result:
+            try:
+                os.remove(aligned_image_path)
+            except OSError:
+                pass
+    return [representation["embedding"] for representation in representations]
+
+
+def compare_faces(image1_path, image2_path, model_name=model_name, deadline=None):
+    """
+    Compare two faces using DeepFace without multiprocessing.
+
+    Concurrent requests for the same image content and model share a single
+    alignment and embedding (and its error). An image rejected by the quality
+    gate fails the comparison with the reason. DeadlineExceeded is raised
+    once ``deadline`` runs out.
+    """
+    from deepface.modules import verification
+
+    try:
+        embeddings = []
+        for field, image_path in (("image1", image1_path), ("image2", image2_path)):
+            try:
+                image_embeddings = represent_shared(image_path, model_name, deadline)
+            except ImageQualityError as e:
+                return False, f"{field}: {e}"
+            embeddings.append(image_embeddings)
+        embeddings1, embeddings2 = embeddings
+
+        # Like DeepFace.verify, keep the closest pair when an image yields several faces
+        distance = min(
+            verification.find_cosine_distance(embedding1, embedding2)
+            for embedding1 in embeddings1
+            for embedding2 in embeddings2
+        )
+        threshold = verification.find_threshold(model_name, "cosine")
+        result = {
+            "verified": bool(distance <= threshold),
+            "distance": float(distance),
+            "threshold": threshold,
+            "model": model_name,
+            "distance_metric": "cosine",
+        }
+        return result, []
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return False, str(e)
 
+
+def represent_shared(image_path, model_name=model_name, deadline=None):
+    """``represent_image`` shared with concurrent requests for the same content, within ``deadline``."""
+    key = (content_key(image_path), model_name)
+    while True:
+        try:
+            embeddings, _ = image_representations.do(
+                key,
+                lambda: represent_image(image_path, model_name, deadline),
+                timeout=deadline.timeout() if deadline is not None else None,
+            )
+            return embeddings
+        except TimeoutError:
+            raise DeadlineExceeded("embedding")
+        except DeadlineExceeded:
+            if deadline is not None and deadline.expired():
+                raise
+            # The shared run belonged to a request with less time left; run it again for this one
+
+
+def detect_face_crops(image_path, to_grayscale=True, downscale_factor=0.5, min_size=MULTI_FACE_MIN_SIZE, max_faces=MULTI_FACE_MAX_FACES, deadline=None):
+    """
+    Detect every face of at least ``min_size`` pixels with MTCNN.
+
+    Returns a list of ``(face_image, box)`` ordered by detection confidence,
+    where ``box`` is ``[x, y, width, height]`` in original image pixels. When
+    no face qualifies, the whole image is the only candidate, like
+    ``compare_faces`` falling back to the unaligned original, unless the
+    quality gate is on: then faces failing it or smaller than ``min_size``
+    are skipped, and ImageQualityError is raised when no face is detected or
+    none passes.
+    """
+    from mtcnn import MTCNN
+
+    check_deadline(deadline, "decode")
+    image, scale = decode_for_detection(image_path, downscale_factor)
+    if image is None:
+        return None, "Image not found or could not be opened."
+
+    check_deadline(deadline, "detection")
+    detector = MTCNN()
+    faces = sorted(detector.detect_faces(image), key=lambda face: face.get('confidence', 0), reverse=True)
+    check_face_detected(faces)
+
+    boxes = [[max(0, x), max(0, y), width, height] for x, y, width, height in (face['box'] for face in faces)]
+    candidates = [
+        (image[y:y + height, x:x + width], [int(round(value / scale)) for value in (x, y, width, height)])
+        for x, y, width, height in select_faces(image, boxes, scale, min_size, max_faces)
+    ]
+    if not candidates:
+        height, width = image.shape[:2]
+        candidates.append((image, [0, 0, int(round(width / scale)), int(round(height / scale))]))
+
+    if to_grayscale:
+        # Keep three channels like the grayscale crops DeepFace reads back from disk
+        candidates = [
+            (cv2.cvtColor(cv2.cvtColor(face_image, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR), box)
+            for face_image, box in candidates
+        ]
+    return candidates, None
+
+
+def embed_faces(face_images, model):
+    """Embed face crops with a loaded model, in a single batched forward pass when the model allows it."""
+    from deepface.modules import preprocessing
+
+    # Same preprocessing as DeepFace.represent, stacked into one batch
+    target_size = model.input_shape
+    batch = np.concatenate([
+        preprocessing.resize_image(img=face_image, target_size=(target_size[1], target_size[0]))
+        for face_image in face_images
+    ])
+
+    keras_model = getattr(model, "model", None)
+    if keras_model is not None and hasattr(keras_model, "predict"):
+        embeddings = np.asarray(keras_model(batch, training=False))
+    else:
+        # Models without a Keras graph (e.g. Dlib, SFace) embed one face at a time
+        embeddings = np.asarray([model.forward(batch[index:index + 1]) for index in range(len(batch))])
+    return embeddings.reshape(len(face_images), -1)
+
+
 # def compare_faces(image1_path, image2_path):
 #     """Compare two faces using DeepFace in a multiprocessing way."""
 #     result_queue1 = Queue()
@@ -0,0 +1,264 @@
+import os
+import importlib.util
+
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+
+from .deadline import check_deadline
+from .deepface_service import (
+    MULTI_FACE_MAX_FACES,
+    MULTI_FACE_MIN_SIZE,
+    compare_faces,
+    detect_face_crops,
+    embed_faces,
+    model_name,
+    represent_image,
+)
+from .image_io import decode_for_detection
+from .quality import ImageQualityError, check_face_detected, select_faces
+
+# Load environment variables
+load_dotenv()
+
+ENGINES = ["deepface", "face_recognition"]
+# Engine used when a request does not choose one
+FACE_ENGINE = os.getenv("FACE_ENGINE", "deepface")
+if FACE_ENGINE not in ENGINES:
+    raise ValueError(f"Invalid engine specified: {FACE_ENGINE}. Must be one of {ENGINES}.")
+# face_recognition's own match tolerance, a Euclidean distance between its 128-d encodings
+FACE_RECOGNITION_TOLERANCE = float(os.getenv("FACE_RECOGNITION_TOLERANCE", 0.6))
+# "hog" runs on any CPU; "cnn" is more accurate and much slower without a GPU
+FACE_RECOGNITION_DETECTOR = os.getenv("FACE_RECOGNITION_DETECTOR", "hog")
+# Re-samples per encoding; higher is slightly more accurate and proportionally slower
+FACE_RECOGNITION_JITTERS = int(os.getenv("FACE_RECOGNITION_JITTERS", 1))
+
+
+def engine_available(name):
+    """Whether the libraries of an engine are installed; face_recognition is an optional dependency."""
+    if name == "face_recognition":
+        return importlib.util.find_spec("face_recognition") is not None
+    return name in ENGINES
+
+
+def cosine_distances(embeddings1, embeddings2):
+    """Cosine distance of every row of ``embeddings1`` to every row of ``embeddings2``."""
+    embeddings1 = np.asarray(embeddings1, dtype=np.float64)
+    embeddings2 = np.asarray(embeddings2, dtype=np.float64)
+    embeddings1 = embeddings1 / np.maximum(np.linalg.norm(embeddings1, axis=1, keepdims=True), 1e-12)
+    embeddings2 = embeddings2 / np.maximum(np.linalg.norm(embeddings2, axis=1, keepdims=True), 1e-12)
+    return 1.0 - embeddings1 @ embeddings2.T
+
+
+class FaceEngine:
+    """
+    Detect, embed and compare faces with one recognition library.
+
+    ``detect`` returns ``(faces, error)`` like ``detect_face_crops``: a list
+    of ``(face, box)`` ordered by confidence, where ``face`` is whatever the
+    engine's ``embed`` needs and ``box`` is ``[x, y, width, height]`` in
+    original image pixels. ``embed`` returns one row per face and
+    ``distance`` a matrix of cosine distances, so calibration tables and
+    ``calculate_confidence`` treat every engine alike. Detectors keep faces
+    of at least MULTI_FACE_MIN_SIZE pixels, at most MULTI_FACE_MAX_FACES, that
+    pass the quality gate (``select_faces``). Until an engine is calibrated,
+    results of a ``threshold_anchored`` engine get a confidence that puts the
+    engine's own threshold at the served one.
+    """
+
+    name = None
+    threshold_anchored = True
+
+    @property
+    def model_name(self):
+        """Name reported as the result's "model", which also selects its calibration table."""
+        return self.name
+
+    @property
+    def threshold(self):
+        """Largest distance the engine itself considers a match."""
+        raise NotImplementedError
+
+    def detect(self, image_path, deadline=None):
+        raise NotImplementedError
+
+    def embed(self, faces):
+        raise NotImplementedError
+
+    def distance(self, embeddings1, embeddings2):
+        return cosine_distances(embeddings1, embeddings2)
+
+    def represent(self, image_path, deadline=None):
+        """Embedding of the best face of an image, computed the way a single-face ``compare`` does."""
+        faces, error = self.detect(image_path, deadline=deadline)
+        if faces is None:
+            raise ValueError(error)
+        return self.embed([faces[0][0]])[0]
+
+    def compare(self, image1_path, image2_path, multi_face=False, deadline=None):
+        """
+        Compare the best face of each image, or with ``multi_face`` every pair of faces.
+
+        Returns ``(result, [])`` or ``(False, reason)`` like ``compare_faces``.
+        """
+        faces = []
+        for field, image_path in (("image1", image1_path), ("image2", image2_path)):
+            try:
+                image_faces, error = self.detect(image_path, deadline=deadline)
+            except ImageQualityError as e:
+                return False, f"{field}: {e}"
+            if image_faces is None:
+                return False, f"{field}: {error}"
+            faces.append(image_faces if multi_face else image_faces[:1])
+        faces1, faces2 = faces
+
+        check_deadline(deadline, "embedding")
+        try:
+            embeddings = self.embed([face for face, _ in faces1] + [face for face, _ in faces2])
+        except Exception as e:
+            return False, str(e)
+        distances = self.distance(embeddings[:len(faces1)], embeddings[len(faces1):])
+        index1, index2 = np.unravel_index(np.argmin(distances), distances.shape)
+        distance = float(distances[index1, index2])
+
+        result = {
+            "verified": distance <= self.threshold,
+            "distance": distance,
+            "threshold": self.threshold,
+            "model": self.model_name,
+            "distance_metric": "cosine",
+            "threshold_anchored": self.threshold_anchored,
+        }
+        if multi_face:
+            result["best_pair"] = {
+                "image1": {"box": faces1[index1][1], "index": int(index1), "candidates": len(faces1)},
+                "image2": {"box": faces2[index2][1], "index": int(index2), "candidates": len(faces2)},
+            }
+        return result, []
+
+
+class DeepFaceEngine(FaceEngine):
+    """The DeepFace pipeline of ``deepface_service``: MTCNN detection and a DeepFace model."""
+
+    name = "deepface"
+    # Uncalibrated DeepFace models keep the linear confidence the service always served
+    threshold_anchored = False
+
+    def __init__(self, model_name=model_name, model=None):
+        self._model_name = model_name
+        self.model = model
+
+    @property
+    def model_name(self):
+        return self._model_name
+
+    @property
+    def threshold(self):
+        from deepface.modules import verification
+
+        return verification.find_threshold(self._model_name, "cosine")
+
+    def detect(self, image_path, deadline=None):
+        return detect_face_crops(image_path, deadline=deadline)
+
+    def embed(self, faces):
+        if self.model is None:
+            from deepface import DeepFace
+
+            self.model = DeepFace.build_model(self._model_name)
+        return embed_faces(faces, self.model)
+
+    def represent(self, image_path, deadline=None):
+        # compare_faces embeds the MTCNN-aligned crop with DeepFace.represent, not detect and embed
+        return represent_image(image_path, self._model_name, deadline)[0]
+
+    def compare(self, image1_path, image2_path, multi_face=False, deadline=None):
+        # Single faces keep the serving path's alignment, coalescing and fallbacks
+        if multi_face:
+            return super().compare(image1_path, image2_path, multi_face=True, deadline=deadline)
+        return compare_faces(image1_path, image2_path, self._model_name, deadline=deadline)
+
+
+class FaceRecognitionEngine(FaceEngine):
+    """
+    dlib through the ``face_recognition`` package: HOG detection and 128-d encodings.
+
+    Much cheaper on CPU than the DeepFace models. Its Euclidean tolerance is
+    converted to the equivalent cosine distance of normalized encodings.
+    """
+
+    name = "face_recognition"
+
+    def __init__(
+        self,
+        tolerance=FACE_RECOGNITION_TOLERANCE,
+        detector=FACE_RECOGNITION_DETECTOR,
+        jitters=FACE_RECOGNITION_JITTERS,
+        min_size=MULTI_FACE_MIN_SIZE,
+        max_faces=MULTI_FACE_MAX_FACES,
+    ):
+        self.tolerance = tolerance
+        self.detector = detector
+        self.jitters = jitters
+        self.min_size = min_size
+        self.max_faces = max_faces
+
+    @property
+    def threshold(self):
+        # For unit vectors, Euclidean distance d and cosine distance c satisfy c = d^2 / 2
+        return self.tolerance ** 2 / 2
+
+    def detect(self, image_path, deadline=None):
+        import face_recognition
+
+        check_deadline(deadline, "decode")
+        image, scale = decode_for_detection(image_path)
+        if image is None:
+            return None, "Image not found or could not be opened."
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        check_deadline(deadline, "detection")
+        locations = face_recognition.face_locations(rgb_image, model=self.detector)
+        check_face_detected(locations)
+        if not locations:
+            return None, "No faces detected."
+        # Largest face first; the HOG detector reports no confidence
+        locations.sort(key=lambda location: (location[2] - location[0]) * (location[1] - location[3]), reverse=True)
+        boxes = [[left, top, right - left, bottom - top] for top, right, bottom, left in locations]
+        kept = select_faces(image, boxes, scale, self.min_size, self.max_faces)
+        if not kept:
+            # Like detect_face_crops without the quality gate: the whole image is the only candidate
+            height, width = image.shape[:2]
+            kept = [[0, 0, width, height]]
+        return [
+            ((rgb_image, (y, x + width, y + height, x)), [int(round(value / scale)) for value in (x, y, width, height)])
+            for x, y, width, height in kept
+        ], None
+
+    def embed(self, faces):
+        import face_recognition
+
+        # One call per image, with every location found in it
+        by_image = {}
+        for index, (image, location) in enumerate(faces):
+            by_image.setdefault(id(image), (image, []))[1].append((index, location))
+        embeddings = [None] * len(faces)
+        for image, entries in by_image.values():
+            encodings = face_recognition.face_encodings(
+                image, known_face_locations=[location for _, location in entries], num_jitters=self.jitters
+            )
+            for (index, _), encoding in zip(entries, encodings):
+                embeddings[index] = encoding
+        return np.asarray(embeddings)
+
+
+def get_engine(name=None, model_name=model_name, model=None):
+    """Build the engine called ``name`` (FACE_ENGINE by default); DeepFace uses ``model_name`` and ``model``."""
+    name = name or FACE_ENGINE
+    if name == "deepface":
+        return DeepFaceEngine(model_name, model)
+    if name == "face_recognition":
+        if not engine_available(name):
+            raise ValueError("The face_recognition engine needs the optional face-recognition package.")
+        return FaceRecognitionEngine()
+    raise ValueError(f"Invalid engine specified: {name}. Must be one of {ENGINES}.")
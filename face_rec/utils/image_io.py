@@ -0,0 +1,168 @@
+import os
+import struct
+
+import cv2
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Optional cap on the longest side of the image handed to the face detector (0 disables it)
+DETECTION_MAX_SIDE = int(os.getenv("DETECTION_MAX_SIDE", 0))
+
+# JPEG decoders can scale the DCT directly; these flags decode at 1/2, 1/4 and 1/8 size
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Start-of-frame markers that carry the image size (C4, C8 and CC are not frames)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def _exif_orientation(segment):
+    """Read the orientation tag from the TIFF structure of an APP1 Exif segment."""
+    if not segment.startswith(b"Exif\x00\x00"):
+        return 1
+    tiff = segment[6:]
+    byte_order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if byte_order is None or len(tiff) < 8:
+        return 1
+    ifd_offset = struct.unpack(byte_order + "I", tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return 1
+    entries = struct.unpack(byte_order + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+    for index in range(entries):
+        entry = ifd_offset + 2 + index * 12
+        if entry + 12 > len(tiff):
+            break
+        tag, field_type = struct.unpack(byte_order + "HH", tiff[entry:entry + 4])
+        if tag == EXIF_ORIENTATION_TAG and field_type == 3:  # SHORT
+            orientation = struct.unpack(byte_order + "H", tiff[entry + 8:entry + 10])[0]
+            return orientation if 1 <= orientation <= 8 else 1
+    return 1
+
+
+def read_jpeg_header(image_path):
+    """
+    Read ``(width, height, orientation)`` from the headers of a JPEG file.
+
+    Only the markers before the first frame are read, so this costs a few
+    kilobytes of I/O. Returns None when the file is not a JPEG.
+    """
+    orientation = 1
+    with open(image_path, "rb") as file:
+        if file.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            byte = file.read(1)
+            while byte and byte != b"\xff":
+                byte = file.read(1)
+            while byte == b"\xff":
+                byte = file.read(1)
+            if not byte:
+                return None
+            marker = byte[0]
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                continue  # markers without a length
+            length_bytes = file.read(2)
+            if len(length_bytes) < 2:
+                return None
+            length = struct.unpack(">H", length_bytes)[0] - 2
+            if marker in SOF_MARKERS:
+                frame = file.read(5)
+                if len(frame) < 5:
+                    return None
+                height, width = struct.unpack(">HH", frame[1:5])
+                return width, height, orientation
+            if marker == 0xE1 and orientation == 1:
+                orientation = _exif_orientation(file.read(length))
+                continue
+            if marker == 0xDA:  # start of scan without a frame header
+                return None
+            file.seek(length, os.SEEK_CUR)
+
+
+def apply_exif_orientation(image, orientation):
+    """Rotate/flip decoded pixels so they are upright according to the EXIF orientation."""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.flip(cv2.transpose(image), -1)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def decode_for_detection(image_path, downscale_factor=0.5, max_side=DETECTION_MAX_SIDE):
+    """
+    Decode an image at the size used for face detection.
+
+    JPEGs are decoded directly at 1/2, 1/4 or 1/8 scale when that does not go
+    below the target size, and only the remaining factor is applied with
+    ``cv2.resize``. EXIF orientation is applied so rotated phone photos come out
+    upright. Returns ``(image, scale)`` where ``scale`` converts coordinates
+    from the full-resolution upright image to the returned one, or
+    ``(None, None)`` when the image cannot be read.
+    """
+    header = read_jpeg_header(image_path)
+    if header is None:
+        image = cv2.imread(image_path)
+        if image is None:
+            return None, None
+        full_height, full_width = image.shape[:2]
+        orientation = 1
+    else:
+        full_width, full_height, orientation = header
+
+    target_scale = min(downscale_factor, 1.0)
+    if max_side and max(full_width, full_height) * target_scale > max_side:
+        target_scale = max_side / max(full_width, full_height)
+
+    if header is not None:
+        flags = cv2.IMREAD_COLOR
+        for reduction, reduced_flag in REDUCED_DECODE_FLAGS:
+            if 1.0 / reduction >= target_scale:
+                flags = reduced_flag
+                break
+        image = cv2.imread(image_path, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image is None:
+            return None, None
+
+    target_size = (max(int(full_width * target_scale), 1), max(int(full_height * target_scale), 1))
+    if (image.shape[1], image.shape[0]) != target_size:
+        image = cv2.resize(image, target_size, interpolation=cv2.INTER_AREA)
+
+    image = apply_exif_orientation(image, orientation)
+    return image, target_scale
+
+
+def load_full_resolution(image_path):
+    """Decode an image at full resolution, upright according to its EXIF orientation."""
+    header = read_jpeg_header(image_path)
+    if header is None:
+        return cv2.imread(image_path)
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        return None
+    return apply_exif_orientation(image, header[2])
+
+
+def crop_full_resolution(image_path, box, scale):
+    """Crop a face from the full-resolution image using a box found on the detection image."""
+    image = load_full_resolution(image_path)
+    if image is None:
+        return None
+    x, y, width, height = (int(round(value / scale)) for value in box)
+    x, y = max(0, x), max(0, y)
+    return image[y:y + height, x:x + width]
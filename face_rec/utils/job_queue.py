@@ -0,0 +1,270 @@
+import os
+import time
+import socket
+from datetime import timedelta
+
+import requests
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from dotenv import load_dotenv
+
+from ..models import ComparisonJob, ComparisonTask
+from .deadline import Deadline
+
+# Load environment variables
+load_dotenv()
+
+# Backpressure: the maximum number of comparisons waiting or running across all jobs
+JOB_QUEUE_MAX_PENDING = int(os.getenv("JOB_QUEUE_MAX_PENDING", 10000))
+# Largest number of comparisons accepted in a single job
+JOB_MAX_COMPARISONS = int(os.getenv("JOB_MAX_COMPARISONS", 1000))
+# Retry-After sent to clients whose job was refused because the queue is full
+JOB_QUEUE_RETRY_AFTER_SECONDS = int(os.getenv("JOB_QUEUE_RETRY_AFTER_SECONDS", 30))
+# How many times a comparison is attempted before it is marked as failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# Seconds a worker may hold a comparison before another worker can take it over
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 300))
+# Base delay in seconds between retries, doubled on every attempt
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", 5))
+# Time budget of one comparison, downloads included; it ends before the lease so a
+# stalled image host cannot keep a task running while another worker takes it over
+JOB_TASK_DEADLINE_SECONDS = float(os.getenv("JOB_TASK_DEADLINE_SECONDS", JOB_LEASE_SECONDS * 0.8))
+JOB_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", 10))
+
+OUTSTANDING_STATUSES = [ComparisonTask.STATUS_PENDING, ComparisonTask.STATUS_RUNNING]
+FINISHED_STATUSES = [ComparisonTask.STATUS_DONE, ComparisonTask.STATUS_FAILED]
+
+
+class QueueFullError(Exception):
+    """Raised when accepting a job would push the queue over JOB_QUEUE_MAX_PENDING."""
+
+    def __init__(self, outstanding, requested):
+        self.outstanding = outstanding
+        self.requested = requested
+        super().__init__(
+            f"Job queue is full: {outstanding} comparisons outstanding, "
+            f"{requested} requested, limit is {JOB_QUEUE_MAX_PENDING}."
+        )
+
+
+def outstanding_task_count():
+    """Number of comparisons that are waiting for or being processed by a worker."""
+    return ComparisonTask.objects.filter(status__in=OUTSTANDING_STATUSES).count()
+
+
+def enqueue_job(comparisons, callback_url=""):
+    """Store a new job with one task per image pair and return it."""
+    with transaction.atomic():
+        # Writing the job first takes SQLite's write lock, so concurrent submissions
+        # count the queue one at a time; a refused job is rolled back with the transaction
+        job = ComparisonJob.objects.create(total=len(comparisons), callback_url=callback_url or "")
+        outstanding = outstanding_task_count()
+        if outstanding + len(comparisons) > JOB_QUEUE_MAX_PENDING:
+            raise QueueFullError(outstanding, len(comparisons))
+        ComparisonTask.objects.bulk_create([
+            ComparisonTask(
+                job=job,
+                index=index,
+                image1=pair["image1"],
+                image2=pair["image2"],
+                multi_face=pair.get("multi_face", False),
+                engine=pair.get("engine") or "",
+                compact=pair.get("compact"),
+            )
+            for index, pair in enumerate(comparisons)
+        ])
+    return job
+
+
+def job_progress(job):
+    """Count the tasks of a job per status."""
+    counts = {value: 0 for value, _ in ComparisonTask.STATUS_CHOICES}
+    for row in job.tasks.values("status").annotate(count=Count("id")):
+        counts[row["status"]] = row["count"]
+    return counts
+
+
+def serialize_job(job, offset=0, limit=None):
+    """Describe a job, its progress and the results of the comparisons finished so far."""
+    progress = job_progress(job)
+    finished = job.tasks.filter(status__in=FINISHED_STATUSES).order_by("index")
+    results = finished[offset:offset + limit] if limit else finished[offset:]
+    return {
+        "jobId": str(job.id),
+        "status": job.status,
+        "total": job.total,
+        "progress": progress,
+        "createdAt": job.created_at.isoformat(),
+        "completedAt": job.completed_at.isoformat() if job.completed_at else None,
+        "callbackStatus": job.callback_status or None,
+        "offset": offset,
+        "results": [
+            {
+                "index": task.index,
+                "status": task.status,
+                "statusCode": task.status_code,
+                "attempts": task.attempts,
+                "result": task.result,
+                "error": task.error or None,
+            }
+            for task in results
+        ],
+    }
+
+
+def claim_next_task(worker_id):
+    """
+    Atomically take the next available task.
+
+    Pending tasks whose retry delay has passed are picked first-come first-served;
+    running tasks whose lease expired (their worker died) are taken over.
+    """
+    now = timezone.now()
+    claimable = (
+        Q(status=ComparisonTask.STATUS_PENDING, available_at__lte=now)
+        | Q(status=ComparisonTask.STATUS_RUNNING, lease_expires_at__lt=now, attempts__lt=JOB_MAX_ATTEMPTS)
+    )
+    candidates = ComparisonTask.objects.filter(claimable).order_by("available_at", "id")
+    for task_id in candidates.values_list("id", flat=True)[:10]:
+        claimed = ComparisonTask.objects.filter(claimable, id=task_id).update(
+            status=ComparisonTask.STATUS_RUNNING,
+            attempts=F("attempts") + 1,
+            lease_expires_at=now + timedelta(seconds=JOB_LEASE_SECONDS),
+            worker=worker_id,
+        )
+        if claimed:
+            task = ComparisonTask.objects.select_related("job").get(id=task_id)
+            ComparisonJob.objects.filter(id=task.job_id, status=ComparisonJob.STATUS_QUEUED).update(
+                status=ComparisonJob.STATUS_RUNNING
+            )
+            return task
+    return None
+
+
+def finish_task(task, payload, status_code):
+    """Record the comparison result of a task."""
+    ComparisonTask.objects.filter(id=task.id, worker=task.worker).update(
+        status=ComparisonTask.STATUS_DONE,
+        status_code=status_code,
+        result=payload,
+        error="",
+        lease_expires_at=None,
+        finished_at=timezone.now(),
+    )
+    complete_job_if_finished(task.job)
+
+
+def retry_or_fail_task(task, error):
+    """Put a task back in the queue with exponential backoff, or fail it when it ran out of attempts."""
+    now = timezone.now()
+    if task.attempts >= JOB_MAX_ATTEMPTS:
+        ComparisonTask.objects.filter(id=task.id, worker=task.worker).update(
+            status=ComparisonTask.STATUS_FAILED,
+            error=error,
+            lease_expires_at=None,
+            finished_at=now,
+        )
+        complete_job_if_finished(task.job)
+        return
+
+    delay = JOB_RETRY_BACKOFF_SECONDS * (2 ** (task.attempts - 1))
+    ComparisonTask.objects.filter(id=task.id, worker=task.worker).update(
+        status=ComparisonTask.STATUS_PENDING,
+        error=error,
+        lease_expires_at=None,
+        available_at=now + timedelta(seconds=delay),
+    )
+
+
+def fail_expired_tasks():
+    """Fail running tasks whose lease expired after their last allowed attempt."""
+    now = timezone.now()
+    expired = ComparisonTask.objects.filter(
+        status=ComparisonTask.STATUS_RUNNING,
+        lease_expires_at__lt=now,
+        attempts__gte=JOB_MAX_ATTEMPTS,
+    ).select_related("job")
+    for task in expired:
+        updated = ComparisonTask.objects.filter(id=task.id, status=ComparisonTask.STATUS_RUNNING).update(
+            status=ComparisonTask.STATUS_FAILED,
+            error="Worker did not finish the comparison in time.",
+            lease_expires_at=None,
+            finished_at=now,
+        )
+        if updated:
+            complete_job_if_finished(task.job)
+
+
+def complete_job_if_finished(job):
+    """Mark a job as completed once all its tasks are finished and notify its callback."""
+    if job.tasks.filter(status__in=OUTSTANDING_STATUSES).exists():
+        return
+    # Only one worker wins the transition, so the callback is sent exactly once
+    updated = ComparisonJob.objects.filter(id=job.id).exclude(status=ComparisonJob.STATUS_COMPLETED).update(
+        status=ComparisonJob.STATUS_COMPLETED,
+        completed_at=timezone.now(),
+    )
+    if updated:
+        job.refresh_from_db()
+        send_callback(job)
+
+
+def send_callback(job):
+    """POST the final job description to the job's callback URL, if any."""
+    if not job.callback_url:
+        return
+    try:
+        response = requests.post(job.callback_url, json=serialize_job(job), timeout=JOB_CALLBACK_TIMEOUT_SECONDS)
+        callback_status = f"HTTP {response.status_code}"
+    except Exception as e:
+        callback_status = f"Failed: {e}"[:255]
+    ComparisonJob.objects.filter(id=job.id).update(callback_status=callback_status)
+
+
+def process_task(task):
+    """Run the comparison pipeline for a claimed task and store the outcome."""
+    # Imported here so the web process only loads the model when it actually compares faces
+    from .comparison_service import compare_image_inputs
+
+    try:
+        # Unreachable image hosts raise, so the task is retried like any other failure
+        payload, status_code = compare_image_inputs(
+            task.image1,
+            task.image2,
+            multi_face=task.multi_face,
+            engine=task.engine or None,
+            compact=task.compact,
+            raise_transient_errors=True,
+            deadline=Deadline(JOB_TASK_DEADLINE_SECONDS),
+        )
+    except Exception as e:
+        print(f"Comparison task {task} failed: {e}")
+        retry_or_fail_task(task, str(e))
+        return
+    if status_code == 504:
+        # Out of time, most likely on a slow image host; worth another attempt
+        retry_or_fail_task(task, payload["reason"])
+        return
+    finish_task(task, payload, status_code)
+
+
+def run_worker(worker_id=None, poll_interval=1.0, stop_after_idle=None):
+    """
+    Process queued comparison tasks until interrupted.
+
+    With ``stop_after_idle`` the worker exits once the queue stayed empty for
+    that many seconds, which is handy for draining the queue from a cron job.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    idle_since = time.monotonic()
+    while True:
+        fail_expired_tasks()
+        task = claim_next_task(worker_id)
+        if task is None:
+            if stop_after_idle is not None and time.monotonic() - idle_since >= stop_after_idle:
+                return
+            time.sleep(poll_interval)
+            continue
+        process_task(task)
+        idle_since = time.monotonic()
@@ -0,0 +1,80 @@
+import os
+import sys
+import random
+import resource
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Recycle a worker once its resident memory exceeds this many MB (0 disables recycling)
+WORKER_MAX_RSS_MB = float(os.getenv("WORKER_MAX_RSS_MB", 0))
+# Each worker adds up to this fraction of the budget so workers do not all restart together
+WORKER_RSS_JITTER = float(os.getenv("WORKER_RSS_JITTER", 0.1))
+
+_budget_bytes = None
+
+
+def current_rss_bytes():
+    """Resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs (e.g. macOS): fall back to the peak, reported in bytes there
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Highest resident set size this process reached."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def tensorflow_memory_info():
+    """Bytes held by TensorFlow's CPU allocator, when TensorFlow is loaded and reports it."""
+    tf = sys.modules.get("tensorflow")
+    if tf is None:
+        return {}
+    try:
+        info = tf.config.experimental.get_memory_info("CPU:0")
+    except Exception:
+        return {}
+    return {"memory.tf_current_bytes": info.get("current", 0), "memory.tf_peak_bytes": info.get("peak", 0)}
+
+
+def cached_model_count():
+    """Number of models held in DeepFace's model cache."""
+    modeling = sys.modules.get("deepface.modules.modeling")
+    cache = getattr(modeling, "cached_models", {}) if modeling is not None else {}
+    return sum(len(models) for models in cache.values() if isinstance(models, dict))
+
+
+def worker_budget_bytes():
+    """This worker's jittered memory budget, drawn once per process; None when recycling is off."""
+    global _budget_bytes
+    if not WORKER_MAX_RSS_MB:
+        return None
+    if _budget_bytes is None:
+        jitter = random.uniform(0, WORKER_RSS_JITTER)
+        _budget_bytes = int(WORKER_MAX_RSS_MB * (1 + jitter) * 1024 * 1024)
+    return _budget_bytes
+
+
+def over_budget():
+    """Whether this worker grew past its memory budget and should be recycled."""
+    budget = worker_budget_bytes()
+    return budget is not None and current_rss_bytes() > budget
+
+
+def collect_memory_metrics():
+    """Gauges describing the memory use of this worker."""
+    gauges = {
+        "memory.rss_bytes": current_rss_bytes(),
+        "memory.rss_peak_bytes": peak_rss_bytes(),
+        "memory.budget_bytes": worker_budget_bytes(),
+        "memory.deepface_cached_models": cached_model_count(),
+    }
+    gauges.update(tensorflow_memory_info())
+    return gauges
@@ -0,0 +1,43 @@
+import os
+import threading
+
+# Per-worker metrics. Every gunicorn worker keeps its own values, tagged with its pid.
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_collectors = []
+
+
+def increment(name, value=1):
+    """Add ``value`` to the counter called ``name``."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name, value):
+    """Set the gauge called ``name`` to ``value``."""
+    with _lock:
+        _gauges[name] = value
+
+
+def register_collector(collector):
+    """Register a callable returning a dict of gauges that is evaluated on every snapshot."""
+    with _lock:
+        if collector not in _collectors:
+            _collectors.append(collector)
+
+
+def snapshot():
+    """Return the current counters and gauges of this worker."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        collectors = list(_collectors)
+
+    for collector in collectors:
+        try:
+            gauges.update(collector())
+        except Exception as e:
+            print(f"Metrics collector {collector} failed: {e}")
+
+    return {"pid": os.getpid(), "counters": counters, "gauges": gauges}
@@ -0,0 +1,233 @@
+import gc
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from . import metrics
+from .deepface_service import MODELS, import_inference_libraries, load_model, model_name, unload_model
+
+# Load environment variables
+load_dotenv()
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+# Shared by every worker: an admin change written here is picked up by all of them
+MODEL_CONFIG_FILE = os.getenv("MODEL_CONFIG_FILE", str(BASE_DIR / "model_config.json"))
+# Threshold used until an admin configures another one
+FIXED_THRESHOLD = int(os.getenv("FIXED_THRESHOLD", 50))
+# Seconds between two checks of MODEL_CONFIG_FILE for changes
+MODEL_CONFIG_CHECK_INTERVAL = float(os.getenv("MODEL_CONFIG_CHECK_INTERVAL", 2))
+
+
+def default_config():
+    return {"model_name": model_name, "fixed_threshold": FIXED_THRESHOLD}
+
+
+def read_config_file(path=MODEL_CONFIG_FILE):
+    """Read the shared model configuration, or None when there is none yet."""
+    try:
+        with open(path) as file:
+            config = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable model config {path}: {e}")
+        return None
+    return {**default_config(), **config}
+
+
+def write_config_file(config, path=MODEL_CONFIG_FILE):
+    """Atomically replace the shared model configuration."""
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, suffix=".tmp") as file:
+        json.dump(config, file)
+    os.replace(file.name, path)
+
+
+class ModelHandle:
+    """A loaded model and the settings served with it, counted while comparisons use it."""
+
+    def __init__(self, config, model):
+        self.config = config
+        self.model_name = config["model_name"]
+        self.fixed_threshold = config["fixed_threshold"]
+        self.model = model
+        self.in_flight = 0
+        self.retired = False
+
+
+class ModelRegistry:
+    """
+    Serve comparisons from the active model and swap in a new one without downtime.
+
+    A new configuration is loaded and warmed up on a background thread while
+    requests keep using the active model. The switch happens under a lock
+    between two ``acquire`` calls; comparisons already running finish on the
+    model they started with, and a retired model is released once its last
+    comparison is done.
+    """
+
+    def __init__(self, config_path=MODEL_CONFIG_FILE):
+        self.config_path = config_path
+        self._lock = threading.Lock()
+        # Serializes the first load so concurrent first requests build the model once
+        self._initial_lock = threading.Lock()
+        self._active = None
+        self._loading_config = None
+        self._last_error = None
+        self._config_mtime = None
+        self._next_check = 0.0
+        self.swaps = 0
+        metrics.register_collector(self.collect_metrics)
+
+    def load_initial(self):
+        """Load the configured model in the foreground, unless it is already loaded."""
+        with self._initial_lock:
+            if self._active is not None:
+                return self._active
+            config = read_config_file(self.config_path) or default_config()
+            self._config_mtime = self._stat_config()
+            handle = ModelHandle(config, load_model(config["model_name"]))
+            with self._lock:
+                if self._active is None:
+                    self._active = handle
+            return self._active
+
+    def preload(self):
+        """
+        Import the inference libraries and load the configured model.
+
+        Serving processes call this once at startup (gunicorn ``post_fork``, the
+        comparison workers) so the first request does not pay for it; anything
+        else loads the model on its first comparison.
+        """
+        started = time.time()
+        import_inference_libraries()
+        handle = self.load_initial()
+        print(f"Preloaded {handle.model_name} in {time.time() - started:.2f} seconds (pid {os.getpid()})")
+        return handle
+
+    @property
+    def loaded(self):
+        return self._active is not None
+
+    @property
+    def active_config(self):
+        handle = self._active
+        return handle.config if handle is not None else (read_config_file(self.config_path) or default_config())
+
+    @contextmanager
+    def acquire(self):
+        """Pin the active model for the duration of one comparison."""
+        self.check_for_update()
+        if self._active is None:
+            self.load_initial()
+        with self._lock:
+            handle = self._active
+            handle.in_flight += 1
+        try:
+            yield handle
+        finally:
+            with self._lock:
+                handle.in_flight -= 1
+                release = handle.retired and handle.in_flight == 0
+            if release:
+                self._release(handle)
+
+    def request_swap(self, config):
+        """Publish a new configuration for every worker and start loading it in this one."""
+        config = {**self.active_config, **config}
+        if config["model_name"] not in MODELS:
+            raise ValueError(f"Invalid model specified: {config['model_name']}. Must be one of {MODELS}.")
+        write_config_file(config, self.config_path)
+        self._config_mtime = self._stat_config()
+        self.swap_in_background(config)
+        return config
+
+    def swap_in_background(self, config):
+        """Load and warm up ``config`` on a background thread, then switch to it."""
+        with self._lock:
+            if self._loading_config == config or (self._active is not None and self._active.config == config):
+                return
+            self._loading_config = config
+        threading.Thread(target=self._load_and_swap, args=(config,), daemon=True).start()
+
+    def check_for_update(self):
+        """Pick up configuration changes published by other workers, at most every MODEL_CONFIG_CHECK_INTERVAL."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + MODEL_CONFIG_CHECK_INTERVAL
+        mtime = self._stat_config()
+        if mtime is None or mtime == self._config_mtime:
+            return
+        self._config_mtime = mtime
+        config = read_config_file(self.config_path)
+        if config is not None and self._active is not None:
+            self.swap_in_background(config)
+
+    def status(self):
+        with self._lock:
+            handle = self._active
+            return {
+                "active": handle.config if handle is not None else None,
+                "in_flight": handle.in_flight if handle is not None else 0,
+                "loading": self._loading_config,
+                "last_error": self._last_error,
+                "swaps": self.swaps,
+                "pid": os.getpid(),
+            }
+
+    def collect_metrics(self):
+        return {"model.swaps": self.swaps, "model.loading": int(self._loading_config is not None)}
+
+    def _load_and_swap(self, config):
+        started = time.time()
+        try:
+            new_handle = ModelHandle(config, load_model(config["model_name"]))
+        except Exception as e:
+            print(f"Loading model config {config} failed: {e}")
+            with self._lock:
+                self._last_error = f"{config['model_name']}: {e}"
+                if self._loading_config == config:
+                    self._loading_config = None
+            return
+
+        with self._lock:
+            if self._loading_config != config:
+                return  # a newer configuration was requested meanwhile
+            old_handle = self._active
+            self._active = new_handle
+            self._loading_config = None
+            self._last_error = None
+            self.swaps += 1
+            release = False
+            if old_handle is not None:
+                old_handle.retired = True
+                release = old_handle.in_flight == 0
+        print(f"Switched to model config {config} in {time.time() - started:.2f} seconds")
+        if release:
+            self._release(old_handle)
+
+    def _release(self, handle):
+        """Free a retired model once nothing uses it anymore."""
+        active = self._active
+        if active is None or active.model_name != handle.model_name:
+            unload_model(handle.model_name)
+        handle.model = None
+        gc.collect()
+        print(f"Released model {handle.model_name}")
+
+    def _stat_config(self):
+        try:
+            return os.stat(self.config_path).st_mtime_ns
+        except OSError:
+            return None
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,113 @@
+import os
+import re
+import time
+import uuid
+import random
+import cProfile
+import threading
+import tracemalloc
+from functools import wraps
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from core.api_middleware import is_admin_request
+
+# Load environment variables
+load_dotenv()
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+# Fraction of requests profiled without being asked to (0 disables sampling)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_SPOOL_DIR = os.getenv("PROFILE_SPOOL_DIR", str(BASE_DIR / "profiles"))
+# Oldest captures are deleted once the spool holds more requests than this
+PROFILE_SPOOL_MAX_CAPTURES = int(os.getenv("PROFILE_SPOOL_MAX_CAPTURES", 50))
+# Frames kept per tracemalloc allocation traceback
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", 10))
+PROFILE_HEADER = "X-Profile"
+
+# cProfile and tracemalloc are process wide, so only one request is captured at a time
+_capture_lock = threading.Lock()
+
+
+def should_profile(request):
+    """Profile when an admin asks for it with the X-Profile header, or when the request is sampled."""
+    if request.headers.get(PROFILE_HEADER) and is_admin_request(request):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def request_id_for(request):
+    """Use the caller's X-Request-ID when it is safe as a file name, otherwise a fresh one."""
+    request_id = re.sub(r"[^A-Za-z0-9_-]", "", request.headers.get("X-Request-ID", ""))[:64]
+    return request_id or uuid.uuid4().hex
+
+
+def trim_spool(spool_dir=PROFILE_SPOOL_DIR, max_captures=PROFILE_SPOOL_MAX_CAPTURES):
+    """Delete the oldest captures so the spool directory stays bounded."""
+    captures = {}
+    for path in Path(spool_dir).glob("*"):
+        captures.setdefault(path.name.split(".", 1)[0], []).append(path)
+    oldest_first = sorted(captures.values(), key=lambda paths: max(path.stat().st_mtime for path in paths))
+    for paths in oldest_first[:max(len(oldest_first) - max_captures, 0)]:
+        for path in paths:
+            try:
+                path.unlink()
+            except OSError:
+                continue
+
+
+def write_capture(request_id, profiler, snapshot, elapsed, spool_dir=PROFILE_SPOOL_DIR):
+    """Write the cProfile stats and the tracemalloc snapshot of one request to the spool."""
+    os.makedirs(spool_dir, exist_ok=True)
+    prefix = os.path.join(spool_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{request_id}")
+    profiler.dump_stats(f"{prefix}.prof")
+    snapshot.dump(f"{prefix}.tracemalloc")
+    with open(f"{prefix}.alloc.txt", "w") as file:
+        file.write(f"request_id: {request_id}\nelapsed: {elapsed:.4f}s\n\n")
+        for stat in snapshot.statistics("lineno")[:50]:
+            file.write(f"{stat}\n")
+    trim_spool(spool_dir)
+    return prefix
+
+
+def profile_request(view_method):
+    """
+    Capture cProfile and tracemalloc data for selected requests of a view method.
+
+    Requests that are not selected only pay for a header lookup and, when
+    sampling is enabled, one random number.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if not should_profile(request) or not _capture_lock.acquire(blocking=False):
+            return view_method(self, request, *args, **kwargs)
+
+        request_id = request_id_for(request)
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        profiler = cProfile.Profile()
+        started = time.time()
+        try:
+            profiler.enable()
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            finally:
+                profiler.disable()
+            elapsed = time.time() - started
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            _capture_lock.release()
+
+        try:
+            prefix = write_capture(request_id, profiler, snapshot, elapsed)
+            print(f"Profile for request {request_id} written to {prefix}.*")
+            response["X-Profile-Id"] = request_id
+        except Exception as e:
+            print(f"Failed to write profile for request {request_id}: {e}")
+        return response
+
+    return wrapper
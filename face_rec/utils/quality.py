@@ -0,0 +1,121 @@
+import os
+
+import cv2
+from dotenv import load_dotenv
+
+from . import metrics
+
+# Load environment variables
+load_dotenv()
+
+# Reject blurry, badly exposed or tiny faces before they are embedded
+QUALITY_GATE = os.getenv("QUALITY_GATE", "true").lower() in ("1", "true", "yes")
+# Smallest face side accepted, in original image pixels
+QUALITY_MIN_FACE_SIZE = int(os.getenv("QUALITY_MIN_FACE_SIZE", 40))
+# Variance of the Laplacian of the face, measured at QUALITY_SHARPNESS_SIZE pixels so it does not depend on resolution
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", 25))
+QUALITY_SHARPNESS_SIZE = int(os.getenv("QUALITY_SHARPNESS_SIZE", 112))
+# Accepted range of the mean gray level of the face (0-255)
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", 40))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", 220))
+
+
+class ImageQualityError(Exception):
+    """An image was rejected by the quality gate; ``check`` names the failed check."""
+
+    def __init__(self, check, message):
+        super().__init__(message)
+        self.check = check
+
+
+def sharpness(gray_face):
+    """Variance of the Laplacian of a grayscale face resized to QUALITY_SHARPNESS_SIZE."""
+    size = (QUALITY_SHARPNESS_SIZE, QUALITY_SHARPNESS_SIZE)
+    resized = cv2.resize(gray_face, size, interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(resized, cv2.CV_64F).var())
+
+
+def assess_face(image, box, scale=1.0):
+    """
+    Return the first failed check of a detected face as ``(check, message)``, or None.
+
+    ``image`` is the decoded detection image, ``box`` the detector's
+    ``[x, y, width, height]`` in that image and ``scale`` the detection image
+    size relative to the original. Checks run from cheapest to most expensive.
+    """
+    x, y, width, height = box
+    face_size = min(width, height) / scale
+    if face_size < QUALITY_MIN_FACE_SIZE:
+        return "face_size", (
+            f"The face is too small ({face_size:.0f}px, minimum {QUALITY_MIN_FACE_SIZE}px). "
+            "Use a closer or higher resolution photo."
+        )
+
+    face = image[max(0, y):y + height, max(0, x):x + width]
+    if face.size == 0:
+        return "face_size", "The detected face lies outside the image."
+    gray_face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY) if face.ndim == 3 else face
+
+    brightness = float(gray_face.mean())
+    if brightness < QUALITY_MIN_BRIGHTNESS:
+        return "underexposed", f"The face is too dark (brightness {brightness:.0f}, minimum {QUALITY_MIN_BRIGHTNESS:.0f})."
+    if brightness > QUALITY_MAX_BRIGHTNESS:
+        return "overexposed", f"The face is overexposed (brightness {brightness:.0f}, maximum {QUALITY_MAX_BRIGHTNESS:.0f})."
+
+    face_sharpness = sharpness(gray_face)
+    if face_sharpness < QUALITY_MIN_SHARPNESS:
+        return "blur", f"The face is too blurry (sharpness {face_sharpness:.1f}, minimum {QUALITY_MIN_SHARPNESS:.0f})."
+    return None
+
+
+def check_face_quality(image, box, scale=1.0):
+    """Raise ImageQualityError when the face fails the quality gate; a no-op when QUALITY_GATE is off."""
+    if not QUALITY_GATE:
+        return
+    failure = assess_face(image, box, scale)
+    if failure is not None:
+        check, message = failure
+        metrics.increment(f"quality.rejected.{check}")
+        raise ImageQualityError(check, message)
+
+
+def select_faces(image, boxes, scale=1.0, min_size=0, max_faces=None):
+    """
+    Keep the detected faces of at least ``min_size`` pixels that pass the quality gate.
+
+    ``boxes`` are detector ``[x, y, width, height]`` boxes in the detection
+    image, best first; at most ``max_faces`` of them are returned. With the
+    gate on, ImageQualityError is raised for the first failure when no face is
+    kept, so callers never fall back to the whole image; with it off an empty
+    list is returned.
+    """
+    kept = []
+    first_failure = None
+    for box in boxes:
+        face_size = min(box[2], box[3]) / scale
+        if face_size < min_size:
+            failure = "face_size", (
+                f"The face is too small ({face_size:.0f}px, minimum {min_size}px). "
+                "Use a closer or higher resolution photo."
+            )
+        else:
+            failure = assess_face(image, box, scale) if QUALITY_GATE else None
+        if failure is not None:
+            first_failure = first_failure or failure
+            continue
+        kept.append(box)
+        if max_faces is not None and len(kept) >= max_faces:
+            break
+
+    if not kept and QUALITY_GATE and first_failure is not None:
+        check, message = first_failure
+        metrics.increment(f"quality.rejected.{check}")
+        raise ImageQualityError(check, message)
+    return kept
+
+
+def check_face_detected(faces):
+    """Raise ImageQualityError when the gate is on and the detector found no face."""
+    if QUALITY_GATE and not faces:
+        metrics.increment("quality.rejected.no_face")
+        raise ImageQualityError("no_face", "No face was detected in the image.")
@@ -0,0 +1,61 @@
+import threading
+
+from . import metrics
+
+
+class _Call:
+    """An in-flight call whose outcome is shared with every caller of the same key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key within a worker process.
+
+    The first caller of a key runs the function; callers arriving while it runs
+    wait and receive the same value, or the same exception. Nothing is cached
+    once the call finishes. Counts are reported as ``singleflight.<name>.executed``
+    and ``singleflight.<name>.shared``.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, timeout=None):
+        """
+        Run ``function`` once for concurrent callers of ``key``. Returns ``(value, shared)``.
+
+        A caller waiting on another caller's run gives up with TimeoutError
+        after ``timeout`` seconds; the run itself is not interrupted.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.increment(f"singleflight.{self.name}.shared")
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for the shared {self.name} of {key!r}")
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        metrics.increment(f"singleflight.{self.name}.executed")
+        try:
+            call.value = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
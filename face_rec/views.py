@@ -5,15 +5,32 @@ from rest_framework.response import Response
 from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from .serializers import FaceComparisonSerializer
-from .utils.deepface_service import compare_faces
-from dotenv import load_dotenv
-load_dotenv()
-import os
+from .models import ComparisonJob
+from core.api_middleware import is_admin_request
+from .serializers import ComparisonJobSerializer, FaceComparisonSerializer, ModelConfigSerializer
+from .utils.comparison_service import (
+    CALIBRATION_TABLES,
+    build_payload,
+    build_timeout_payload,
+    calculate_confidence,
+    compact_requested,
+    compare_validated_images,
+    format_validation_errors,
+)
+from .utils import metrics
+from .utils.admission import ADMISSION_RETRY_AFTER_SECONDS, compare_admission
+from .utils.deadline import DEADLINE_HEADER, Deadline, DeadlineExceeded
+from .utils.job_queue import JOB_QUEUE_RETRY_AFTER_SECONDS, QueueFullError, enqueue_job, serialize_job
+from .utils.model_registry import model_registry
+from .utils.profiling import profile_request
 
 class FaceComparisonView(APIView):
     """API view to handle face comparison requests."""
-    fixed_threshold = int(os.getenv("FIXED_THRESHOLD",50))
+
+    @property
+    def fixed_threshold(self):
+        """Threshold of the model configuration currently being served."""
+        return model_registry.active_config["fixed_threshold"]
 
     def handle_exception(self, exc):
         """
@@ -21,32 +38,17 @@ class FaceComparisonView(APIView):
         """
         # Check if it's a validation error
         if hasattr(exc, 'detail') and isinstance(exc.detail, dict):
-            # Simplify error messages
-            errors = {}
-            for field, messages in exc.detail.items():
-                if isinstance(messages, list):  # Handle list of error messages
-                    # Extract only the message string, ignoring 'ErrorDetail' structure
-                    errors[field] = " ".join(
-                        str(message).split("string='")[1].split("',")[0] if "string='" in str(message) else str(message)
-                        for message in messages
-                    )
-                else:
-                    # Handle non-list error messages
-                    errors[field] = str(messages)
-
-            # Combine all error messages into a single string
-            detailed_reason = " | ".join(f"{field}: {msg}" for field, msg in errors.items())
-
             # Create a custom payload similar to the 200 response format
-            payload = {
-                "status": False,
-                "reason": detailed_reason,  # Clear and explanatory error message
-                "confidenceLevel": None,
-                "threshold": self.fixed_threshold,
-                "match": False,
-                "image1": self.request.data.get("image1", None),
-                "image2": self.request.data.get("image2", None),
-            }
+            payload = build_payload(
+                False,
+                format_validation_errors(exc.detail),  # Clear and explanatory error message
+                None,
+                self.fixed_threshold,
+                False,
+                self.request.data.get("image1", None),
+                self.request.data.get("image2", None),
+                compact_requested(self.request.data),
+            )
             return Response(payload, status=status.HTTP_400_BAD_REQUEST)
 
         # Default behavior for other exceptions
@@ -63,6 +65,20 @@ class FaceComparisonView(APIView):
                 type=openapi.TYPE_STRING,
                 required=True
             ),
+            openapi.Parameter(
+                'X-Profile',
+                openapi.IN_HEADER,
+                description="Admin only: capture cProfile and tracemalloc data for this request",
+                type=openapi.TYPE_STRING,
+                required=False
+            ),
+            openapi.Parameter(
+                DEADLINE_HEADER,
+                openapi.IN_HEADER,
+                description="Time budget of the request in seconds (default and maximum set by the server)",
+                type=openapi.TYPE_NUMBER,
+                required=False
+            ),
         ],
         responses={
             200: openapi.Response(
@@ -90,58 +106,71 @@ class FaceComparisonView(APIView):
                     }
                 }
             ),
+            504: openapi.Response(
+                description="The request deadline ran out; \"timeout\" names the stage that was reached (\"admission\" while queued for a slot)",
+                examples={
+                    "application/json": {
+                        "error": {
+                            "status": False,
+                            "reason": "Request deadline of 30 seconds exceeded during download.",
+                            "confidenceLevel": None,
+                            "threshold": 50,
+                            "match": False,
+                            "image1": "https://example.com/image1.jpg",
+                            "image2": "https://example.com/image2.jpg",
+                            "timeout": {"stage": "download", "budgetSeconds": 30.0, "elapsedSeconds": 30.004}
+                        }
+                    }
+                }
+            ),
+            503: openapi.Response(
+                description="Worker overloaded, retry after the Retry-After header",
+                examples={
+                    "application/json": {
+                        "status": False,
+                        "reason": "Server is busy: comparison queue is full, please retry later.",
+                        "confidenceLevel": None,
+                        "threshold": 50,
+                        "match": False,
+                        "image1": "https://example.com/image1.jpg",
+                        "image2": "https://example.com/image2.jpg"
+                    }
+                }
+            ),
         },
-        operation_description="Compare two faces based on the provided images. The images can be provided as URLs or Base64-encoded strings.",
+        operation_description="Compare two faces based on the provided images. The images can be provided as URLs or Base64-encoded strings. With multi_face, every detected face is compared and the response adds \"faces\" with the box of the best-matching face in each image. With compact, image1 and image2 in the response are \"sha256:<hex>\" hashes of the inputs as sent instead of the inputs themselves.",
     )
+    @profile_request
     def post(self, request, *args, **kwargs):
+        # The budget starts on arrival, so time spent queued for a slot counts too
+        deadline = Deadline.from_request(request)
+        # Shed load before downloading anything when this worker is saturated
+        admitted, reason = compare_admission.acquire(timeout=deadline.remaining())
+        if not admitted:
+            try:
+                deadline.check("admission")
+            except DeadlineExceeded as e:
+                # The budget ran out queued for a slot: the same 504 as running out during the comparison
+                return self.timeout_response(e, deadline)
+            return self.overloaded_response(reason)
         try:
-            serializer = FaceComparisonSerializer(data=request.data)
-            serializer.is_valid(raise_exception=True) 
-            image1_path = serializer.validated_data["image1_temp_path"]
-            image2_path = serializer.validated_data["image2_temp_path"]
-            image1 = serializer.validated_data["image1"]
-            image2 = serializer.validated_data["image2"]
-            
+            return self.compare(request, deadline)
+        finally:
+            compare_admission.release()
 
-            # Step 3: Compare the faces
-            result,error_message_or_path = compare_faces(image1_path, image2_path)
-            
-            # clean up process
-            temp_image_path = [image1_path,image2_path]
-            if isinstance(error_message_or_path,list):
-                temp_image_path = temp_image_path + error_message_or_path
-        
-            for path in temp_image_path:
-                try:
-                    os.remove(path)
-                except:
-                    continue
-            
-                
-            if result:
-                confidence_level,fixed_threshold,verified,reason = self.calculate_confidence(result,self.fixed_threshold)
-                payload = {
-                    "status": True,
-                    "reason": reason,
-                    "confidenceLevel": confidence_level,
-                    "threshold": fixed_threshold,
-                    "match": verified,
-                    "image1": image1,
-                    "image2": image2,
-                }
+    def compare(self, request, deadline=None):
+        try:
+            serializer = FaceComparisonSerializer(data=request.data, context={"deadline": deadline})
+            try:
+                serializer.is_valid(raise_exception=True)
+            except DeadlineExceeded as e:
+                return self.timeout_response(e, deadline)
+
+            # Compare the faces and build the payload
+            payload, status_code = compare_validated_images(serializer.validated_data, deadline=deadline)
+            if status_code == status.HTTP_200_OK:
                 return Response(payload, status=status.HTTP_200_OK)
-            
-            else:
-                payload = {
-                    "status": False,
-                    "reason": error_message_or_path,
-                    "confidenceLevel": None,
-                    "threshold":  fixed_threshold,
-                    "match": False,
-                    "image1": image1,
-                    "image2": image2,
-                }
-                return Response({"error": payload}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"error": payload}, status=status_code)
             
         except Exception as e:
             print(f"Exception caught in post method: {e}")
@@ -149,16 +178,194 @@ class FaceComparisonView(APIView):
 
 
     def calculate_confidence(self, result, fixed_threshold=80):
-        print(result)
-        # Extract the original distance
-        distance = result.get('distance', 0.0)
-        confidence_level = (1 - distance) * 100
-        print(confidence_level)
-
-        # Clamp and round the confidence level
-        confidence_level = round(max(min(confidence_level, 100), 0))
-
-        verified = confidence_level >= fixed_threshold
-        reason = "Images Match" if verified else "Image does not match"
-        
-        return confidence_level, fixed_threshold,verified,reason
+        return calculate_confidence(result, fixed_threshold)
+
+    def timeout_response(self, error, deadline):
+        """504 for a request whose deadline ran out before its comparison ran."""
+        payload = build_timeout_payload(
+            error,
+            deadline,
+            self.fixed_threshold,
+            self.request.data.get("image1"),
+            self.request.data.get("image2"),
+            compact_requested(self.request.data),
+        )
+        return Response({"error": payload}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+
+    def overloaded_response(self, reason):
+        """Fast 503 in the same shape as the comparison payload."""
+        payload = build_payload(
+            False,
+            reason,
+            None,
+            self.fixed_threshold,
+            False,
+            self.request.data.get("image1", None),
+            self.request.data.get("image2", None),
+            compact_requested(self.request.data),
+        )
+        response = Response(payload, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response["Retry-After"] = str(ADMISSION_RETRY_AFTER_SECONDS)
+        return response
+
+
+API_KEY_PARAMETER = openapi.Parameter(
+    'X-API-Key',
+    openapi.IN_HEADER,
+    description="API key for authentication",
+    type=openapi.TYPE_STRING,
+    required=True
+)
+
+
+class ComparisonJobView(APIView):
+    """Submit a batch of face comparisons to be processed asynchronously."""
+
+    @swagger_auto_schema(
+        request_body=ComparisonJobSerializer,
+        manual_parameters=[API_KEY_PARAMETER],
+        responses={
+            202: openapi.Response(
+                description="Job accepted",
+                examples={
+                    "application/json": {
+                        "jobId": "3f1c0a52-5c3e-4a57-9a59-0c1b0f6f2d1e",
+                        "status": "queued",
+                        "total": 2,
+                    }
+                }
+            ),
+            400: openapi.Response(description="Validation Error"),
+            503: openapi.Response(
+                description="Job queue is full, retry later",
+                examples={
+                    "application/json": {
+                        "error": "Job queue is full: 9999 comparisons outstanding, 2 requested, limit is 10000."
+                    }
+                }
+            ),
+        },
+        operation_description="Queue a list of image pairs for comparison. Poll the returned job or pass a callback_url to be notified when every comparison is finished.",
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = ComparisonJobSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({"error": format_validation_errors(serializer.errors)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            job = enqueue_job(
+                serializer.validated_data["comparisons"],
+                serializer.validated_data.get("callback_url", ""),
+            )
+        except QueueFullError as e:
+            response = Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response["Retry-After"] = str(JOB_QUEUE_RETRY_AFTER_SECONDS)
+            return response
+
+        payload = {"jobId": str(job.id), "status": job.status, "total": job.total}
+        response = Response(payload, status=status.HTTP_202_ACCEPTED)
+        response["Location"] = request.build_absolute_uri(f"{request.path.rstrip('/')}/{job.id}")
+        return response
+
+
+class ComparisonJobDetailView(APIView):
+    """Poll the progress and the partial results of a comparison job."""
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            API_KEY_PARAMETER,
+            openapi.Parameter('offset', openapi.IN_QUERY, description="Skip this many finished results", type=openapi.TYPE_INTEGER),
+            openapi.Parameter('limit', openapi.IN_QUERY, description="Return at most this many finished results", type=openapi.TYPE_INTEGER),
+        ],
+        operation_description="Return the job status, per-status progress counts and the results of the comparisons finished so far, ordered by their position in the job.",
+    )
+    def get(self, request, job_id, *args, **kwargs):
+        try:
+            job = ComparisonJob.objects.get(id=job_id)
+        except ComparisonJob.DoesNotExist:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            offset = max(int(request.query_params.get("offset", 0)), 0)
+            limit = int(request.query_params["limit"]) if "limit" in request.query_params else None
+        except ValueError:
+            return Response({"error": "offset and limit must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        if limit is not None and limit < 1:
+            return Response({"error": "limit must be at least 1"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(serialize_job(job, offset=offset, limit=limit), status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """Admin only: expose the counters and gauges of the worker that serves the request."""
+
+    @swagger_auto_schema(
+        manual_parameters=[API_KEY_PARAMETER],
+        responses={403: openapi.Response(description="Admin API key required")},
+        operation_description="Return this worker's metrics, such as admission queue depth, shed counts and the usage of every API key. Each gunicorn worker reports its own values.",
+    )
+    def get(self, request, *args, **kwargs):
+        # The metrics include every tenant's rate limit usage
+        if not is_admin_request(request):
+            return Response({"error": "Admin API key required"}, status=status.HTTP_403_FORBIDDEN)
+        return Response(metrics.snapshot(), status=status.HTTP_200_OK)
+
+
+class HealthView(APIView):
+    """Liveness probe that answers without loading the model."""
+
+    @swagger_auto_schema(
+        operation_description="Report that the worker is up and whether it has loaded its model yet. No API key required.",
+    )
+    def get(self, request, *args, **kwargs):
+        return Response({"status": "ok", "modelLoaded": model_registry.loaded}, status=status.HTTP_200_OK)
+
+
+class ModelConfigView(APIView):
+    """Admin only: inspect the served model configuration and hot-swap it without restarting workers."""
+
+    @swagger_auto_schema(
+        manual_parameters=[API_KEY_PARAMETER],
+        operation_description="Return the active model configuration of the worker serving the request and any configuration it is loading.",
+    )
+    def get(self, request, *args, **kwargs):
+        if not is_admin_request(request):
+            return Response({"error": "Admin API key required"}, status=status.HTTP_403_FORBIDDEN)
+        return Response(model_registry.status(), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        request_body=ModelConfigSerializer,
+        manual_parameters=[API_KEY_PARAMETER],
+        responses={
+            202: openapi.Response(
+                description="New configuration published; workers load and warm it up in the background",
+                examples={
+                    "application/json": {
+                        "requested": {"model_name": "ArcFace", "fixed_threshold": 60},
+                        "active": {"model_name": "Facenet512", "fixed_threshold": 50},
+                    }
+                }
+            ),
+            403: openapi.Response(description="Admin API key required"),
+        },
+        operation_description="Switch every worker to another model and/or threshold. Each worker loads and warms up the new model in the background and switches between requests; comparisons already running finish on the previous model. For a calibrated model the threshold applies to the calibrated confidence, and the response adds a \"warning\" when it differs from the threshold the model was calibrated at.",
+    )
+    def post(self, request, *args, **kwargs):
+        if not is_admin_request(request):
+            return Response({"error": "Admin API key required"}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = ModelConfigSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({"error": format_validation_errors(serializer.errors)}, status=status.HTTP_400_BAD_REQUEST)
+
+        requested = model_registry.request_swap(serializer.validated_data)
+        payload = {"requested": requested, "active": model_registry.active_config}
+        calibration = CALIBRATION_TABLES.get(requested["model_name"])
+        if calibration and calibration["threshold_confidence"] != requested["fixed_threshold"]:
+            # The threshold still applies, on the calibrated confidence scale, but away from the calibrated FAR
+            payload["warning"] = (
+                f"{requested['model_name']} is calibrated for a FAR of {calibration['operating_point']['far']:.6g} "
+                f"at a threshold of {calibration['threshold_confidence']}; a threshold of "
+                f"{requested['fixed_threshold']} moves away from that operating point."
+            )
+        return Response(payload, status=status.HTTP_202_ACCEPTED)
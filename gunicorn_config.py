@@ -1,31 +1,32 @@
 # gunicorn_config.py
 
-from deepface import DeepFace
 import os
 
-MODELS = [
-    "VGG-Face", 
-    "Facenet", 
-    "Facenet512", 
-    "OpenFace", 
-    "DeepFace", 
-    "DeepID", 
-    "ArcFace", 
-    "Dlib", 
-    "SFace", 
-    "GhostFaceNet"
-]
-
-# Global variable to hold the model
-deepface_model = None
+from face_rec.utils import memory
+from face_rec.utils.admission import ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE
+
+# Threaded workers, so the admission controller sees concurrent requests: enough
+# threads for the running and queued comparisons plus one to shed the next request with a 503
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", ADMISSION_MAX_IN_FLIGHT + ADMISSION_MAX_QUEUE + 1))
+# Connections waiting to be accepted; a spike beyond this is refused instead of queued for minutes
+backlog = int(os.getenv("GUNICORN_BACKLOG", 64))
+
 
 def post_fork(server, worker):
-    """Load the DeepFace model after the worker process is forked."""
-    global deepface_model
-    model_name = os.getenv("DEEPFACE_MODEL", "VGG-Face")
-    if model_name not in MODELS:
-        raise ValueError(f"Invalid model specified: {model_name}. Must be one of {MODELS}.")
-    
-    # Load the model
-    deepface_model = DeepFace.build_model(model_name)
-    server.log.info(f"{model_name} model loaded in worker {worker.pid}")
+    """Import the inference libraries and load the served model after the worker process is forked."""
+    # Imported here so the arbiter itself never loads TensorFlow
+    from face_rec.utils.model_registry import model_registry
+
+    handle = model_registry.preload()
+    server.log.info(f"{handle.model_name} model loaded in worker {worker.pid}")
+
+
+def post_request(worker, req, environ, resp):
+    """Recycle the worker gracefully once it outgrows its memory budget (WORKER_MAX_RSS_MB)."""
+    if worker.alive and memory.over_budget():
+        rss_mb = memory.current_rss_bytes() / (1024 * 1024)
+        budget_mb = memory.worker_budget_bytes() / (1024 * 1024)
+        worker.log.info(f"Worker {worker.pid} uses {rss_mb:.0f}MB of its {budget_mb:.0f}MB budget, recycling it")
+        # The worker finishes the request in progress, exits, and the arbiter starts a fresh one
+        worker.alive = False